@@ -0,0 +1,121 @@
+import gzip
+import json
+import time
+import zlib
+import random
+import argparse
+import tracemalloc
+
+from uxapi import jsonlib
+from uxapi import OkexWSHandler, HuobiWSHandler
+
+
+def okex_decode_old(data):
+    bytes_ = zlib.decompress(data, wbits=-zlib.MAX_WBITS)
+    msg = bytes_.decode()
+    try:
+        return json.loads(msg)
+    except json.JSONDecodeError:
+        return msg
+
+
+def huobi_decode_old(data):
+    msg = gzip.decompress(data).decode()
+    return json.loads(msg)
+
+
+def okex_frames(count, rng):
+    frames = []
+    for _ in range(count):
+        msg = {
+            'table': 'spot/depth_l2_tbt',
+            'action': 'update',
+            'data': [{
+                'instrument_id': 'BTC-USDT',
+                'asks': [[f'{10000 + rng.random() * 50:.1f}', f'{rng.random():.8f}', '0', '3']
+                         for _ in range(10)],
+                'bids': [[f'{10000 - rng.random() * 50:.1f}', f'{rng.random():.8f}', '0', '2']
+                         for _ in range(10)],
+                'timestamp': '2020-09-01T00:00:00.000Z',
+                'checksum': -1234567890,
+            }]
+        }
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        frames.append(compressor.compress(json.dumps(msg).encode()) + compressor.flush())
+    return frames
+
+
+def huobi_frames(count, rng):
+    frames = []
+    for _ in range(count):
+        msg = {
+            'ch': 'market.btcusdt.mbp.150',
+            'ts': 1600000000000,
+            'tick': {
+                'seqNum': 2, 'prevSeqNum': 1,
+                'asks': [[10000 + rng.random() * 50, rng.random()] for _ in range(10)],
+                'bids': [[10000 - rng.random() * 50, rng.random()] for _ in range(10)],
+            }
+        }
+        frames.append(gzip.compress(json.dumps(msg).encode()))
+    return frames
+
+
+def timeit(decode, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            decode(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_alloc(decode, frames):
+    # 每帧解码过程中的峰值内存分配(不含解码结果之外的常驻对象)
+    tracemalloc.start()
+    total = 0
+    for frame in frames:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        decode(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - base
+    tracemalloc.stop()
+    return total / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='python bench_decode.py [-h] [--count COUNT] [--repeat REPEAT]',
+        description='Okex/Huobi Frame Decode Benchmark',
+        epilog='Example: python bench_decode.py --count 50000',
+    )
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cases = [
+        ('okex', okex_frames(args.count, rng), okex_decode_old,
+         lambda data: OkexWSHandler.decode(None, data)),
+        ('huobi', huobi_frames(args.count, rng), huobi_decode_old,
+         lambda data: HuobiWSHandler.decode(None, data)),
+    ]
+    print(f'json backend: {jsonlib.get_backend()}')
+    sample = min(args.count, 2000)
+    for name, frames, old, new in cases:
+        assert old(frames[0]) == new(frames[0])
+        results = {}
+        for label, decode in (('before', old), ('after', new)):
+            seconds = timeit(decode, frames, args.repeat)
+            alloc = peak_alloc(decode, frames[:sample])
+            results[label] = seconds
+            print(f'{name:>6} {label:>6}: {seconds:.3f}s  '
+                  f'{len(frames) / seconds:,.0f} frames/s  peak {alloc:,.0f} B/frame')
+        print(f'{name:>6} speed-up: {results["before"] / results["after"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
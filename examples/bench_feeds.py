@@ -0,0 +1,187 @@
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import multiprocessing
+
+import uxapi
+from uxapi import ExecutionError
+from uxapi import OrderBookManager
+from uxapi import BinanceWSHandler, OkexWSHandler, HuobiWSHandler, BitmexWSHandler
+
+import mock_exchange
+
+
+class MockTopicsMixin:
+    """topic_set 直接使用交易所格式的频道名, 不需要加载 markets"""
+
+    reconnect = False
+
+    def convert_topic(self, topic):
+        return topic
+
+    @property
+    def login_required(self):
+        return False
+
+
+class MockBinanceWSHandler(MockTopicsMixin, BinanceWSHandler):
+    pass
+
+
+class MockOkexWSHandler(MockTopicsMixin, OkexWSHandler):
+    pass
+
+
+class MockHuobiWSHandler(MockTopicsMixin, HuobiWSHandler):
+    pass
+
+
+class MockBitmexWSHandler(MockTopicsMixin, BitmexWSHandler):
+    pass
+
+
+def binance_feed(baseurl, symbols):
+    exchange = uxapi.new_exchange('binance', 'spot')
+    exchange.urls['api']['public'] = f'{baseurl}/binance/api/v3'
+    exchange.load_markets()
+    topics = {f'{base.lower()}usdt@depth@100ms' for base in symbols}
+    wsurl = f'{baseurl}/binance/stream'
+    return exchange, MockBinanceWSHandler(exchange, wsurl, topics, 'market')
+
+
+def okex_feed(baseurl, symbols):
+    exchange = uxapi.new_exchange('okex', 'spot')
+    topics = {f'spot/depth_l2_tbt:{base}-USDT' for base in symbols}
+    return exchange, MockOkexWSHandler(exchange, f'{baseurl}/okex/ws', topics)
+
+
+def huobi_feed(baseurl, symbols):
+    exchange = uxapi.new_exchange('huobi', 'futures')
+    topics = {f'market.{base}_CQ.depth.size_150.high_freq?data_type=incremental'
+              for base in symbols}
+    return exchange, MockHuobiWSHandler(exchange, f'{baseurl}/huobi/ws', topics, 'market')
+
+
+def bitmex_feed(baseurl, symbols):
+    exchange = uxapi.new_exchange('bitmex', 'swap')
+    topics = {f'orderBookL2:{base}USD' for base in symbols}
+    return exchange, MockBitmexWSHandler(exchange, f'{baseurl}/bitmex/realtime', topics)
+
+
+FEEDS = {
+    'binance': binance_feed,
+    'okex': okex_feed,
+    'huobi': huobi_feed,
+    'bitmex': bitmex_feed,
+}
+
+
+def start_server(port, options):
+    process = multiprocessing.Process(
+        target=mock_exchange.serve, args=('127.0.0.1', port), kwargs=options, daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError('mock exchange did not start')
+            time.sleep(0.1)
+
+
+async def measure(feed, baseurl, symbols, merge):
+    exchange, wshandler = feed(baseurl, symbols)
+    manager = OrderBookManager(exchange, wshandler) if merge else None
+    latencies = []
+    received = 0
+    first = None
+
+    def collector(msg):
+        nonlocal received, first
+        if first is None:
+            first = time.perf_counter()
+        received += 1
+        sent = msg.get('_sent')
+        if manager:
+            try:
+                manager(msg)
+            except StopIteration:
+                pass
+        if sent is not None:
+            latencies.append(time.time() - sent)
+
+    cpu = time.process_time()
+    try:
+        await wshandler.run(collector)
+    except ExecutionError as exc:
+        # 服务端推送 count 条消息后关闭连接, 其他错误(如合并失败)照常抛出
+        if not str(exc.__cause__).startswith('unexpected message'):
+            raise
+    elapsed = time.perf_counter() - (first or time.perf_counter())
+    cpu = time.process_time() - cpu
+    return received, elapsed, cpu, latencies
+
+
+def report(name, received, elapsed, cpu, latencies):
+    if received < 2 or not latencies:
+        print(f'{name:>8}: {received} msgs')
+        return
+    q = statistics.quantiles(latencies, n=100)
+    print(f'{name:>8}: {received} msgs  {received / elapsed:>9,.0f} msgs/s  '
+          f'cpu {cpu / received * 1e6:6.1f} us/msg  '
+          f'latency ms p50 {q[49] * 1e3:6.2f}  p90 {q[89] * 1e3:6.2f}  '
+          f'p99 {q[98] * 1e3:6.2f}  max {max(latencies) * 1e3:6.2f}')
+
+
+async def main(args):
+    options = {
+        'rate': args.rate,
+        'count': args.count,
+        'changes': args.changes,
+        'depth': args.depth,
+    }
+    server = start_server(args.port, options)
+    baseurl = f'http://127.0.0.1:{args.port}'
+    symbols = mock_exchange.BinanceMock.symbols[:args.symbols]
+    try:
+        print(f'json backend: {uxapi.jsonlib.get_backend()}  rate: {args.rate or "unthrottled"}  '
+              f'symbols: {len(symbols)}  merge: {args.merge}')
+        for name in args.exchanges:
+            result = await measure(FEEDS[name], baseurl, symbols, args.merge)
+            report(name, *result)
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        usage='python bench_feeds.py [-h] [--rate RATE] [--count COUNT] [--symbols SYMBOLS] '
+              '[--changes CHANGES] [--depth DEPTH] [--no-merge] [--port PORT] '
+              '[exchange ...]',
+        description='End-to-end WSHandler/OrderBookMerger Benchmark against a local mock exchange',
+        epilog='Example: python bench_feeds.py --rate 0 --count 50000 okex huobi',
+    )
+    parser.add_argument('exchanges', nargs='*', metavar='exchange',
+                        help=f'any of {", ".join(FEEDS)} (default: all)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='updates per second per symbol, 0 = unthrottled')
+    parser.add_argument('--count', type=int, default=20000,
+                        help='data messages per connection')
+    parser.add_argument('--symbols', type=int, default=1)
+    parser.add_argument('--changes', type=int, default=5)
+    parser.add_argument('--depth', type=int, default=150)
+    parser.add_argument('--no-merge', dest='merge', action='store_false',
+                        help='measure receive/decode only, without order book mergers')
+    parser.add_argument('--port', type=int, default=18766)
+    args = parser.parse_args()
+    args.exchanges = args.exchanges or list(FEEDS)
+    for name in args.exchanges:
+        if name not in FEEDS:
+            parser.error(f'invalid exchange: {name}')
+    asyncio.run(main(args))
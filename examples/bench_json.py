@@ -0,0 +1,120 @@
+import json
+import time
+import random
+import argparse
+
+from uxapi import jsonlib
+
+
+def binance_frame(rng):
+    return {
+        'stream': 'btcusdt@depth@100ms',
+        'data': {
+            'e': 'depthUpdate', 'E': 1600000000000, 's': 'BTCUSDT',
+            'U': 1, 'u': 2,
+            'b': [[f'{10000 - rng.random() * 50:.2f}', f'{rng.random():.6f}'] for _ in range(10)],
+            'a': [[f'{10000 + rng.random() * 50:.2f}', f'{rng.random():.6f}'] for _ in range(10)],
+        }
+    }
+
+
+def okex_frame(rng):
+    return {
+        'table': 'spot/depth_l2_tbt',
+        'action': 'update',
+        'data': [{
+            'instrument_id': 'BTC-USDT',
+            'asks': [[f'{10000 + rng.random() * 50:.1f}', f'{rng.random():.8f}', '0', '3']
+                     for _ in range(10)],
+            'bids': [[f'{10000 - rng.random() * 50:.1f}', f'{rng.random():.8f}', '0', '2']
+                     for _ in range(10)],
+            'timestamp': '2020-09-01T00:00:00.000Z',
+            'checksum': -1234567890,
+        }]
+    }
+
+
+def huobi_frame(rng):
+    return {
+        'ch': 'market.btcusdt.mbp.150',
+        'ts': 1600000000000,
+        'tick': {
+            'seqNum': 2, 'prevSeqNum': 1,
+            'asks': [[10000 + rng.random() * 50, rng.random()] for _ in range(10)],
+            'bids': [[10000 - rng.random() * 50, rng.random()] for _ in range(10)],
+        }
+    }
+
+
+def bitmex_frame(rng):
+    return {
+        'table': 'orderBookL2',
+        'action': 'update',
+        'data': [{'symbol': 'XBTUSD', 'id': 8799000000 + rng.randint(0, 10000),
+                  'side': rng.choice(('Buy', 'Sell')), 'size': rng.randint(1, 100000)}
+                 for _ in range(10)]
+    }
+
+
+generators = {
+    'binance': binance_frame,
+    'okex': okex_frame,
+    'huobi': huobi_frame,
+    'bitmex': bitmex_frame,
+}
+
+
+def load_frames(path):
+    # 每行一条已经解压的原始消息
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\n') for line in f if line.strip()]
+
+
+def run(loads, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            loads(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='python bench_json.py [-h] [--file FILE] [--count COUNT] [--repeat REPEAT]',
+        description='JSON Decoder Backend Benchmark',
+        epilog='Example: python bench_json.py --count 100000',
+    )
+    parser.add_argument('--file', help='recorded frames, one message per line')
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        samples = {args.file: load_frames(args.file)}
+    else:
+        rng = random.Random(0)
+        samples = {
+            name: [json.dumps(gen(rng)).encode() for _ in range(args.count)]
+            for name, gen in generators.items()
+        }
+
+    backends = jsonlib.available_backends()
+    print(f'backends: {", ".join(backends)}')
+    for name, frames in samples.items():
+        results = {}
+        for backend in backends:
+            jsonlib.set_backend(backend)
+            results[backend] = run(jsonlib.loads, frames, args.repeat)
+        baseline = results['json']
+        for backend, seconds in results.items():
+            rate = len(frames) / seconds
+            print(f'{name:>10} {backend:>7}: {seconds:.3f}s  {rate:,.0f} msg/s  '
+                  f'{baseline / seconds:.2f}x')
+    jsonlib.set_backend()
+
+
+if __name__ == '__main__':
+    main()
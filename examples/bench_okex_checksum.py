@@ -0,0 +1,108 @@
+import time
+import copy
+import random
+import argparse
+
+from uxapi import OkexOrderBookMerger
+
+
+def signed(crc32):
+    return crc32 - (1 << 32) if crc32 >= (1 << 31) else crc32
+
+
+def synthesize(depth, count, seed=0):
+    rng = random.Random(seed)
+    tick = 0.1
+    mid = 10000.0
+
+    def level(price, amount=None):
+        if amount is None:
+            amount = f'{rng.randint(1, 500)}'
+        return [f'{price:.1f}', amount, '0', f'{rng.randint(1, 9)}']
+
+    partial = {
+        'table': 'futures/depth_l2_tbt',
+        'action': 'partial',
+        'data': [{
+            'instrument_id': 'BTC-USD-SIM',
+            'asks': [level(mid + (i + 1) * tick) for i in range(depth)],
+            'bids': [level(mid - (i + 1) * tick) for i in range(depth)],
+            'timestamp': '0',
+            'checksum': 0,
+        }],
+    }
+
+    updates = []
+    for n in range(count):
+        asks = []
+        bids = []
+        for _ in range(rng.randint(1, 10)):
+            offset = int(rng.expovariate(1 / (depth / 3))) + 1
+            amount = '0' if rng.random() < 0.2 else None
+            if rng.random() < 0.5:
+                asks.append(level(mid + offset * tick, amount))
+            else:
+                bids.append(level(mid - offset * tick, amount))
+        updates.append({
+            'table': 'futures/depth_l2_tbt',
+            'action': 'update',
+            'data': [{
+                'instrument_id': 'BTC-USD-SIM',
+                'asks': asks,
+                'bids': bids,
+                'timestamp': str(n + 1),
+                'checksum': 0,
+            }],
+        })
+
+    # 用完整校验的算法算出每次更新后的 checksum
+    merger = OkexOrderBookMerger()
+    merger.validate = lambda: None
+    for msg in [partial] + updates:
+        merger(copy.deepcopy(msg))
+        data = merger.snapshot['data'][0]
+        msg['data'][0]['checksum'] = signed(merger.full_crc32(data))
+    return partial, updates
+
+
+def run(partial, updates, repeat, **options):
+    best = None
+    for _ in range(repeat):
+        merger = OkexOrderBookMerger(**options)
+        merger(copy.deepcopy(partial))
+        msgs = copy.deepcopy(updates)
+        start = time.perf_counter()
+        for msg in msgs:
+            merger(msg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='python bench_okex_checksum.py [-h] [--depth DEPTH] [--count COUNT] [--repeat N]',
+        description='Okex Checksum Validation Benchmark',
+        epilog='Example: python bench_okex_checksum.py --depth 400 --count 100000',
+    )
+    parser.add_argument('--depth', type=int, default=400)
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    partial, updates = synthesize(args.depth, args.count)
+    modes = [
+        ('none', {'validate_every': len(updates) + 1}),
+        ('full', {'validation': 'full'}),
+        ('incremental', {'validation': 'incremental'}),
+        ('full/10', {'validation': 'full', 'validate_every': 10}),
+        ('incremental/10', {'validation': 'incremental', 'validate_every': 10}),
+    ]
+    for name, options in modes:
+        seconds = run(partial, updates, args.repeat, **options)
+        rate = len(updates) / seconds
+        print(f'{name:>15}: {seconds:.3f}s  {rate:,.0f} updates/s')
+
+
+if __name__ == '__main__':
+    main()
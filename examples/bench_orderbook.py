@@ -0,0 +1,126 @@
+import json
+import time
+import random
+import bisect
+import argparse
+
+from uxapi import OrderBook
+
+
+class ListBook:
+    """旧的实现: 每个合并器各自维护价格列表 + 原始档位列表"""
+
+    def __init__(self, asks, bids):
+        self.asks = list(asks)
+        self.bids = list(bids)
+        self.prices = {
+            'asks': [float(item[0]) for item in asks],
+            'bids': [-float(item[0]) for item in bids],
+        }
+
+    def update(self, asks, bids):
+        self.merge_asks_bids(self.asks, asks, self.prices['asks'], False)
+        self.merge_asks_bids(self.bids, bids, self.prices['bids'], True)
+
+    def merge_asks_bids(self, snapshot_lst, patch_lst, price_lst, negative_price):
+        for item in patch_lst:
+            price, amount = float(item[0]), float(item[1])
+            if negative_price:
+                price = -price
+            i = bisect.bisect_left(price_lst, price)
+            if i != len(price_lst) and price_lst[i] == price:
+                if amount == 0:
+                    price_lst.pop(i)
+                    snapshot_lst.pop(i)
+                else:
+                    snapshot_lst[i] = item
+            else:
+                if amount != 0:
+                    price_lst.insert(i, price)
+                    snapshot_lst.insert(i, item)
+
+
+def load_stream(path):
+    # 每行一条 binance depth 消息(combined stream 格式)
+    # 第一行可以是 REST 快照: {"lastUpdateId": ..., "asks": [...], "bids": [...]}
+    snapshot = {'asks': [], 'bids': []}
+    patches = []
+    with open(path) as f:
+        for line in f:
+            msg = json.loads(line)
+            if 'lastUpdateId' in msg:
+                snapshot = msg
+            else:
+                data = msg.get('data', msg)
+                patches.append((data['a'], data['b']))
+    return snapshot, patches
+
+
+def synthesize(depth, count, seed=0):
+    rng = random.Random(seed)
+    tick = 0.01
+    mid = 10000.0
+
+    def level(price):
+        return [f'{price:.2f}', f'{rng.random() * 10:.4f}']
+
+    snapshot = {
+        'asks': [level(mid + (i + 1) * tick) for i in range(depth)],
+        'bids': [level(mid - (i + 1) * tick) for i in range(depth)],
+    }
+    patches = []
+    for _ in range(count):
+        mid += rng.choice((-tick, 0, tick))
+        asks = []
+        bids = []
+        for _ in range(rng.randint(1, 20)):
+            offset = int(rng.expovariate(1 / (depth / 4))) + 1
+            amount = '0' if rng.random() < 0.3 else f'{rng.random() * 10:.4f}'
+            if rng.random() < 0.5:
+                asks.append([f'{mid + offset * tick:.2f}', amount])
+            else:
+                bids.append([f'{mid - offset * tick:.2f}', amount])
+        patches.append((asks, bids))
+    return snapshot, patches
+
+
+def run(book_class, snapshot, patches):
+    book = book_class(snapshot['asks'], snapshot['bids'])
+    start = time.perf_counter()
+    for asks, bids in patches:
+        book.update(asks, bids)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='python bench_orderbook.py [-h] [--file FILE] [--depth DEPTH] [--count COUNT] '
+              '[--repeat REPEAT]',
+        description='Order Book Merge Benchmark',
+        epilog='Example: python bench_orderbook.py --depth 1000 --count 200000',
+    )
+    parser.add_argument('--file', help='recorded binance depth stream (json lines)')
+    parser.add_argument('--depth', type=int, default=1000)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='run each implementation REPEAT times and keep the best')
+    args = parser.parse_args()
+
+    if args.file:
+        snapshot, patches = load_stream(args.file)
+    else:
+        snapshot, patches = synthesize(args.depth, args.count)
+
+    # 交替运行, 取最好的一次, 减少机器负载波动的影响
+    baseline = elapsed = float('inf')
+    for _ in range(args.repeat):
+        baseline = min(baseline, run(ListBook, snapshot, patches))
+        elapsed = min(elapsed, run(OrderBook, snapshot, patches))
+    for name, seconds in (('list', baseline), ('OrderBook', elapsed)):
+        rate = len(patches) / seconds
+        print(f'{name:>10}: {seconds:.3f}s  {rate:,.0f} patches/s')
+    print(f'speed-up: {baseline / elapsed:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import json
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from uxapi import WSHandler
+from uxapi import ExecutionError
+
+
+class LoopbackWSHandler(WSHandler):
+    reconnect = False
+
+    def __init__(self, wsurl):
+        super().__init__(None, wsurl, set())
+
+    def prepare(self):
+        pass
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class TaskPerMessageWSHandler(LoopbackWSHandler):
+    """旧的实现: 每条消息创建一个 recv task"""
+
+    async def do_run(self, collector):
+        while True:
+            if 'recv' not in self.awaitables:
+                self.awaitables.create_task(self.recv(), 'recv')
+            name, result = await self.awaitables.wait()
+            if name == 'recv' and result is not None:
+                try:
+                    msg = self.pre_process(result)
+                except StopIteration:
+                    continue
+                else:
+                    if collector:
+                        collector(msg)
+
+
+async def start_server(count, port):
+    frame = json.dumps({
+        'stream': 'btcusdt@trade',
+        'data': {'e': 'trade', 's': 'BTCUSDT', 'p': '10000.00', 'q': '0.001'},
+    })
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        for _ in range(count):
+            await ws.send_str(frame)
+        await ws.close()
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    return runner
+
+
+async def measure(handler_class, wsurl):
+    received = 0
+
+    def collector(msg):
+        nonlocal received
+        received += 1
+
+    wshandler = handler_class(wsurl)
+    start = time.perf_counter()
+    try:
+        await wshandler.run(collector)
+    except ExecutionError:
+        pass    # 服务端发送完毕后关闭连接
+    return received, time.perf_counter() - start
+
+
+async def main(args):
+    runner = await start_server(args.count, args.port)
+    wsurl = f'http://127.0.0.1:{args.port}/'
+    try:
+        results = {}
+        for name, handler_class in (('task/msg', TaskPerMessageWSHandler),
+                                    ('reader', LoopbackWSHandler)):
+            best = None
+            for _ in range(args.repeat):
+                received, seconds = await measure(handler_class, wsurl)
+                best = seconds if best is None else min(best, seconds)
+            results[name] = best
+            print(f'{name:>10}: {received} msgs  {best:.3f}s  {received / best:,.0f} msgs/s')
+        print(f'speed-up: {results["task/msg"] / results["reader"]:.2f}x')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        usage='python bench_recv.py [-h] [--count COUNT] [--repeat REPEAT] [--port PORT]',
+        description='Websocket Receive Loop Benchmark (loopback)',
+        epilog='Example: python bench_recv.py --count 200000',
+    )
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--port', type=int, default=18765)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,551 @@
+"""本地模拟交易所, 用于不依赖真实行情的吞吐量测试
+
+实现 Binance(现货 combined stream + REST 深度快照), Okex(raw deflate),
+Huobidm(gzip) 和 Bitmex 的 websocket 协议: 订阅确认, ping/pong,
+以及按给定速率推送的全量 + 增量深度。同一品种的所有订阅者共享一个
+深度源, Binance 的 REST 快照和 websocket 增量因此序列号一致。
+
+每条数据消息带有顶层字段 `_sent` (服务端生成消息时的 time.time()),
+客户端据此统计端到端延迟。每个连接推送 count 条数据消息后服务端主动关闭。
+
+    python mock_exchange.py --port 18766 --rate 1000
+"""
+
+import gzip
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import binascii
+from itertools import chain, zip_longest
+
+from aiohttp import web, WSMsgType
+
+
+class MockBook:
+    """以整数价格(tick)为键的随机深度, 卖单在 mid 之上, 买单在 mid 之下"""
+
+    def __init__(self, rng, depth=150, mid=1000000):
+        self.rng = rng
+        self.depth = depth
+        self.mid = mid
+        self.asks = {}
+        self.bids = {}
+        for i in range(1, depth + 1):
+            self.asks[mid + i] = self.random_size()
+            self.bids[mid - i] = self.random_size()
+
+    def random_size(self):
+        return round(self.rng.uniform(0.001, 5), 4)
+
+    def step(self, n):
+        """随机修改 n 档, 返回 (side, ticks, size, existed) 列表, size 为 0 表示删除
+
+        同一档在一次修改中最多出现一次, Bitmex 按 action 分组发送时顺序才不会错乱
+        """
+        rng = self.rng
+        changes = []
+        seen = set()
+        for _ in range(n):
+            side = rng.choice(('asks', 'bids'))
+            levels = getattr(self, side)
+            offset = rng.randint(1, self.depth + self.depth // 4)
+            ticks = self.mid + offset if side == 'asks' else self.mid - offset
+            if ticks in seen:
+                continue
+            seen.add(ticks)
+            existed = ticks in levels
+            if existed and (rng.random() < 0.3 or len(levels) > self.depth):
+                size = 0
+                del levels[ticks]
+            else:
+                size = self.random_size()
+                levels[ticks] = size
+            changes.append((side, ticks, size, existed))
+        return changes
+
+    def sorted_asks(self):
+        return sorted(self.asks.items())
+
+    def sorted_bids(self):
+        return sorted(self.bids.items(), reverse=True)
+
+
+class Subscriber:
+    def __init__(self, ws, count):
+        self.ws = ws
+        self.remaining = count
+        self.closed = False
+        self.feeds = set()
+
+    async def send(self, frame, data=True):
+        if self.closed:
+            return
+        try:
+            if isinstance(frame, bytes):
+                await self.ws.send_bytes(frame)
+            else:
+                await self.ws.send_str(frame)
+        except (ConnectionError, RuntimeError):
+            self.close()
+            return
+        if data:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.close()
+                await self.ws.close()
+
+    def close(self):
+        self.closed = True
+        for feed in self.feeds:
+            feed.subscribers.discard(self)
+        self.feeds.clear()
+
+
+class Feed:
+    """一个品种的深度源, 按 rate(条/秒, 0 表示不限速)向所有订阅者推送增量"""
+
+    def __init__(self, exchange, symbol, topic):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.topic = topic
+        self.book = MockBook(random.Random(symbol), exchange.depth)
+        self.seqnum = 1
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self, subscriber):
+        subscriber.feeds.add(self)
+        self.subscribers.add(subscriber)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        exchange = self.exchange
+        rate = exchange.rate
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        try:
+            while self.subscribers:
+                if rate:
+                    due = int((loop.time() - start) * rate) - sent
+                    if due <= 0:
+                        await asyncio.sleep(max(1 / rate, 0.001))
+                        continue
+                else:
+                    due = 1
+                for _ in range(due):
+                    changes = self.book.step(exchange.changes)
+                    self.seqnum += 1
+                    for msg in exchange.update_messages(self, changes):
+                        msg['_sent'] = time.time()
+                        frame = exchange.encode(msg)
+                        for subscriber in list(self.subscribers):
+                            await subscriber.send(frame)
+                    sent += 1
+                if not rate:
+                    await asyncio.sleep(0)
+        finally:
+            self.task = None
+
+
+class MockExchange:
+    """模拟交易所的基类, 子类实现各自的消息格式"""
+
+    path = None
+
+    def __init__(self, rate=100, count=10000, changes=5, depth=150):
+        self.rate = rate
+        self.count = count
+        self.changes = changes
+        self.depth = depth
+        self.feeds = {}
+
+    def routes(self):
+        return [web.get(self.path, self.websocket)]
+
+    def feed(self, topic):
+        symbol = self.symbol(topic)
+        feed = self.feeds.get(symbol)
+        if feed is None:
+            feed = self.feeds[symbol] = Feed(self, symbol, topic)
+        return feed
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscriber = Subscriber(ws, self.count)
+        keepalive = asyncio.ensure_future(self.keepalive(subscriber))
+        try:
+            await self.on_connected(subscriber, request)
+            async for wsmsg in ws:
+                if wsmsg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    await self.on_message(subscriber, wsmsg.data)
+        finally:
+            keepalive.cancel()
+            subscriber.close()
+        return ws
+
+    async def keepalive(self, subscriber):
+        pass
+
+    async def on_connected(self, subscriber, request):
+        pass
+
+    async def on_message(self, subscriber, data):
+        raise NotImplementedError
+
+    async def subscribe(self, subscriber, topic):
+        feed = self.feed(topic)
+        await subscriber.send(self.encode(self.ack_message(topic)), data=False)
+        snapshot = self.snapshot_message(feed)
+        if snapshot is not None:
+            snapshot['_sent'] = time.time()
+            await subscriber.send(self.encode(snapshot))
+        feed.subscribe(subscriber)
+
+    def symbol(self, topic):
+        raise NotImplementedError
+
+    def ack_message(self, topic):
+        raise NotImplementedError
+
+    def snapshot_message(self, feed):
+        raise NotImplementedError
+
+    def update_messages(self, feed, changes):
+        raise NotImplementedError
+
+    def encode(self, msg):
+        return json.dumps(msg, separators=(',', ':'))
+
+
+class BinanceMock(MockExchange):
+    """现货 combined stream: /binance/stream?streams=btcusdt@depth@100ms"""
+
+    path = '/binance/stream'
+    symbols = ('BTC', 'ETH', 'LTC', 'EOS', 'XRP', 'BCH', 'ETC', 'TRX')
+
+    def routes(self):
+        return super().routes() + [
+            web.get('/binance/api/v3/exchangeInfo', self.exchange_info),
+            web.get('/binance/api/v3/depth', self.depth_snapshot),
+        ]
+
+    async def on_connected(self, subscriber, request):
+        streams = request.query.get('streams', '')
+        for stream in filter(None, streams.split('/')):
+            await self.subscribe(subscriber, stream)
+
+    async def on_message(self, subscriber, data):
+        pass
+
+    def symbol(self, topic):
+        return topic.split('@', 1)[0].upper()
+
+    async def subscribe(self, subscriber, topic):
+        # combined stream 没有订阅确认, 深度快照通过 REST 获取
+        self.feed(topic).subscribe(subscriber)
+
+    async def exchange_info(self, request):
+        symbols = [{
+            'symbol': f'{base}USDT',
+            'status': 'TRADING',
+            'baseAsset': base,
+            'baseAssetPrecision': 8,
+            'quoteAsset': 'USDT',
+            'quotePrecision': 8,
+            'isSpotTradingAllowed': True,
+            'isMarginTradingAllowed': False,
+            'filters': [
+                {'filterType': 'PRICE_FILTER', 'minPrice': '0.01',
+                 'maxPrice': '1000000.00', 'tickSize': '0.01'},
+                {'filterType': 'LOT_SIZE', 'minQty': '0.0001',
+                 'maxQty': '9000.0000', 'stepSize': '0.0001'},
+            ],
+        } for base in self.symbols]
+        return web.json_response({
+            'timezone': 'UTC',
+            'serverTime': int(time.time() * 1000),
+            'rateLimits': [],
+            'exchangeFilters': [],
+            'symbols': symbols,
+        })
+
+    async def depth_snapshot(self, request):
+        symbol = request.query['symbol']
+        limit = int(request.query.get('limit', 1000))
+        feed = self.feed(f'{symbol.lower()}@depth@100ms')
+        book = feed.book
+        return web.json_response({
+            'lastUpdateId': feed.seqnum,
+            'asks': [self.level(*item) for item in book.sorted_asks()[:limit]],
+            'bids': [self.level(*item) for item in book.sorted_bids()[:limit]],
+        })
+
+    @staticmethod
+    def level(ticks, size):
+        return [f'{ticks / 100:.2f}', f'{size:.4f}']
+
+    def update_messages(self, feed, changes):
+        asks = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'asks']
+        bids = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'bids']
+        now = int(time.time() * 1000)
+        return [{
+            'stream': feed.topic,
+            'data': {
+                'e': 'depthUpdate',
+                'E': now,
+                's': feed.symbol,
+                'U': feed.seqnum,
+                'u': feed.seqnum,
+                'b': bids,
+                'a': asks,
+            }
+        }]
+
+
+class OkexMock(MockExchange):
+    """v3 websocket, 每帧单独 raw deflate 压缩, 客户端 'ping' 回复 'pong'"""
+
+    path = '/okex/ws'
+    checksum_depth = 25
+
+    async def on_message(self, subscriber, data):
+        if data == 'ping':
+            await subscriber.send(self.encode('pong'), data=False)
+            return
+        msg = json.loads(data)
+        if msg.get('op') == 'subscribe':
+            for topic in msg['args']:
+                await self.subscribe(subscriber, topic)
+
+    def symbol(self, topic):
+        return topic.split(':', 1)[1]
+
+    def ack_message(self, topic):
+        return {'event': 'subscribe', 'channel': topic}
+
+    @staticmethod
+    def level(ticks, size):
+        return [f'{ticks / 10:.1f}', f'{size:.4f}', '0', '1']
+
+    def checksum(self, book):
+        depth = self.checksum_depth
+        asks = (self.level(*item)[:2] for item in book.sorted_asks()[:depth])
+        bids = (self.level(*item)[:2] for item in book.sorted_bids()[:depth])
+        items = filter(None, chain(*zip_longest(bids, asks)))
+        crc32 = binascii.crc32(':'.join(chain(*items)).encode())
+        return crc32 - (1 << 32) if crc32 >= (1 << 31) else crc32
+
+    def data(self, feed, asks, bids):
+        return {
+            'instrument_id': feed.symbol,
+            'asks': asks,
+            'bids': bids,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            'checksum': self.checksum(feed.book),
+        }
+
+    def snapshot_message(self, feed):
+        book = feed.book
+        asks = [self.level(*item) for item in book.sorted_asks()]
+        bids = [self.level(*item) for item in book.sorted_bids()]
+        return {
+            'table': feed.topic.split(':', 1)[0],
+            'action': 'partial',
+            'data': [self.data(feed, asks, bids)],
+        }
+
+    def update_messages(self, feed, changes):
+        asks = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'asks']
+        bids = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'bids']
+        return [{
+            'table': feed.topic.split(':', 1)[0],
+            'action': 'update',
+            'data': [self.data(feed, asks, bids)],
+        }]
+
+    def encode(self, msg):
+        text = msg if isinstance(msg, str) else super().encode(msg)
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        return compressor.compress(text.encode()) + compressor.flush()
+
+
+class HuobiMock(MockExchange):
+    """Huobidm 市场行情(size_150.high_freq 增量深度), gzip 压缩, 服务端每 5 秒 ping"""
+
+    path = '/huobi/ws'
+    ping_interval = 5
+
+    async def keepalive(self, subscriber):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await subscriber.send(self.encode({'ping': int(time.time() * 1000)}), data=False)
+
+    async def on_message(self, subscriber, data):
+        if isinstance(data, bytes):
+            data = zlib.decompress(data, zlib.MAX_WBITS | 16)
+        msg = json.loads(data)
+        if 'sub' in msg:
+            await self.subscribe(subscriber, msg['sub'])
+
+    def symbol(self, topic):
+        return topic.split('.', 2)[1]
+
+    def ack_message(self, topic):
+        return {'id': None, 'status': 'ok', 'subbed': topic, 'ts': int(time.time() * 1000)}
+
+    @staticmethod
+    def level(ticks, size):
+        return [round(ticks / 10, 1), size]
+
+    def tick(self, feed, event, asks, bids):
+        now = int(time.time() * 1000)
+        return {
+            'ch': feed.topic,
+            'ts': now,
+            'tick': {
+                'mrid': feed.seqnum,
+                'id': now // 1000,
+                'ts': now,
+                'version': feed.seqnum,
+                'ch': feed.topic,
+                'event': event,
+                'asks': asks,
+                'bids': bids,
+            }
+        }
+
+    def snapshot_message(self, feed):
+        book = feed.book
+        asks = [self.level(*item) for item in book.sorted_asks()]
+        bids = [self.level(*item) for item in book.sorted_bids()]
+        return self.tick(feed, 'snapshot', asks, bids)
+
+    def update_messages(self, feed, changes):
+        asks = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'asks']
+        bids = [self.level(ticks, size) for side, ticks, size, _ in changes if side == 'bids']
+        return [self.tick(feed, 'update', asks, bids)]
+
+    def encode(self, msg):
+        return gzip.compress(super().encode(msg).encode(), compresslevel=1)
+
+
+class BitmexMock(MockExchange):
+    """orderBookL2: partial 之后按 id 推送 update/insert/delete"""
+
+    path = '/bitmex/realtime'
+
+    async def on_connected(self, subscriber, request):
+        await subscriber.send(self.encode({
+            'info': 'Welcome to the mock BitMEX Realtime API.',
+            'version': 'mock',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+        }), data=False)
+
+    async def on_message(self, subscriber, data):
+        if data == 'ping':
+            await subscriber.send('pong', data=False)
+            return
+        msg = json.loads(data)
+        if msg.get('op') == 'subscribe':
+            for topic in msg['args']:
+                await self.subscribe(subscriber, topic)
+
+    def symbol(self, topic):
+        return topic.split(':', 1)[1]
+
+    def ack_message(self, topic):
+        return {
+            'success': True,
+            'subscribe': topic,
+            'request': {'op': 'subscribe', 'args': [topic]},
+        }
+
+    @staticmethod
+    def item(symbol, side, ticks, size=None):
+        item = {
+            'symbol': symbol,
+            'id': 8800000000 - ticks,
+            'side': 'Sell' if side == 'asks' else 'Buy',
+        }
+        if size is not None:
+            item['size'] = max(int(size * 1000), 1)
+            item['price'] = ticks / 2
+        return item
+
+    def snapshot_message(self, feed):
+        book = feed.book
+        asks = reversed(book.sorted_asks())
+        bids = book.sorted_bids()
+        items = [self.item(feed.symbol, 'asks', *level) for level in asks]
+        items += [self.item(feed.symbol, 'bids', *level) for level in bids]
+        return {
+            'table': 'orderBookL2',
+            'action': 'partial',
+            'keys': ['symbol', 'id', 'side'],
+            'filter': {'symbol': feed.symbol},
+            'data': items,
+        }
+
+    def update_messages(self, feed, changes):
+        groups = {'update': [], 'insert': [], 'delete': []}
+        for side, ticks, size, existed in changes:
+            if size == 0:
+                groups['delete'].append(self.item(feed.symbol, side, ticks))
+            elif existed:
+                item = self.item(feed.symbol, side, ticks, size)
+                del item['price']
+                groups['update'].append(item)
+            else:
+                groups['insert'].append(self.item(feed.symbol, side, ticks, size))
+        return [{'table': 'orderBookL2', 'action': action, 'data': data}
+                for action, data in groups.items() if data]
+
+
+MOCK_EXCHANGES = {
+    'binance': BinanceMock,
+    'okex': OkexMock,
+    'huobi': HuobiMock,
+    'bitmex': BitmexMock,
+}
+
+
+def create_app(**options):
+    app = web.Application()
+    for mock_class in MOCK_EXCHANGES.values():
+        app.add_routes(mock_class(**options).routes())
+    return app
+
+
+def serve(host='127.0.0.1', port=18766, **options):
+    web.run_app(create_app(**options), host=host, port=port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='python mock_exchange.py [-h] [--port PORT] [--rate RATE] [--count COUNT] '
+              '[--changes CHANGES] [--depth DEPTH]',
+        description='Local Mock Exchange (binance/okex/huobi/bitmex)',
+        epilog='Example: python mock_exchange.py --rate 1000',
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18766)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='updates per second per symbol, 0 = unthrottled')
+    parser.add_argument('--count', type=int, default=10000,
+                        help='data messages per connection before the server closes it')
+    parser.add_argument('--changes', type=int, default=5,
+                        help='changed levels per update')
+    parser.add_argument('--depth', type=int, default=150)
+    args = parser.parse_args()
+    serve(args.host, args.port, rate=args.rate, count=args.count,
+          changes=args.changes, depth=args.depth)
+
+
+if __name__ == '__main__':
+    main()
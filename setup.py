@@ -17,6 +17,7 @@ REQUIRED = [
 ]
 
 EXTRAS = {
+    'fast': ['orjson'],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+import uxapi
+
+
+class FakeSend:
+    def __init__(self):
+        self.requests = []
+
+    async def __call__(self, r, cost):
+        self.requests.append(r)
+        return {'url': r['url']}
+
+
+class RunAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.exchange = uxapi.new_exchange('binance', 'spot')
+        self.exchange.enableRateLimit = False
+        self.send = self.exchange._asend = FakeSend()
+
+    def run_async(self, method):
+        return asyncio.run(self.exchange.run_async(method))
+
+    def test_clock_derived_params(self):
+        # 参数随时间变化, 每次重新执行都不同, 仍然按位置取用响应
+        exchange = self.exchange
+
+        def method():
+            first = exchange.public_get_klines({'startTime': exchange.milliseconds()})
+            second = exchange.public_get_depth({'nonce': exchange.uuid()})
+            return first, second
+
+        first, second = self.run_async(method)
+        self.assertEqual(len(self.send.requests), 2)
+        self.assertIn('/klines', first['url'])
+        self.assertIn('/depth', second['url'])
+
+    def test_changed_request_is_not_resent(self):
+        exchange = self.exchange
+        paths = iter(['klines', 'depth'])
+
+        def method():
+            return exchange.request(next(paths), 'public', 'GET', {})
+
+        with self.assertRaises(RuntimeError):
+            self.run_async(method)
+        self.assertEqual(len(self.send.requests), 1)
+
+    def test_max_requests(self):
+        exchange = self.exchange
+
+        def method():
+            while True:
+                exchange.public_get_time()
+
+        with self.assertRaises(RuntimeError):
+            self.run_async(method)
+        self.assertEqual(len(self.send.requests), uxapi.patch._AsyncCall.max_requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
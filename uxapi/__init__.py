@@ -1,10 +1,11 @@
 from uxapi.__version__ import VERSION, __version__
 from uxapi.symbol import UXSymbol
 from uxapi.topic import UXTopic
-from uxapi.pipeline import Pipeline
+from uxapi.pipeline import Pipeline, ProcessorChain
 from uxapi.listiter import listiter
+from uxapi import jsonlib
 from uxapi.event import Event
-from uxapi.queue import Queue
+from uxapi.queue import Queue, MessageQueue
 from uxapi.session import Session
 from uxapi.awaitables import (
     Awaitables,
@@ -12,8 +13,22 @@ from uxapi.awaitables import (
     ExecutionResult,
     ExecutionError,
 )
+from uxapi.ratelimit import RateLimiter
+from uxapi.coalesce import RequestCoalescer
+from uxapi.marketcache import MarketCache
 from uxapi.patch import UXPatch
-from uxapi.wshandler import WSHandler
+from uxapi.conflator import Conflator
+from uxapi.wshandler import WSHandler, ConnectionClosed
+from uxapi.orderbook import (
+    OrderBook,
+    OrderBookView,
+    OrderBookMerger,
+    OrderBookManager,
+    BBOEvent,
+)
+from uxapi.sharding import ShardedWSHandler
+from uxapi.workers import ProcessPoolWSHandler, BookUpdate
+from uxapi.recorder import FrameRecorder, FrameReplayer
 
 
 _registry = {}
@@ -1,5 +1,6 @@
 import functools
 import asyncio
+from collections import deque
 from typing import NamedTuple, Optional
 
 from uxapi import Event
@@ -16,13 +17,21 @@ class ExecutionResult(NamedTuple):
 
 
 class Awaitables:
+    """一组具名的 task/future
+
+    完成的 task 通过 done callback 放进完成队列, wait() 每次从队列中取出
+    一个, 不需要每次都对全部 task 调用 asyncio.wait。
+    """
+
     @staticmethod
     def default():
         return _default
 
     def __init__(self):
         self.aws = {}
-        self.aws_changed = Event()
+        self.names = {}
+        self.completed = deque()
+        self.completion = Event()
 
     def __iter__(self):
         return iter(self.aws)
@@ -32,11 +41,9 @@ class Awaitables:
 
     def __contains__(self, aw_or_name):
         if isinstance(aw_or_name, str):
-            name = aw_or_name
-            return bool(name and name in self.aws.values())
+            return aw_or_name in self.names
         else:
-            aw = aw_or_name
-            return aw in self.aws
+            return aw_or_name in self.aws
 
     def get_name(self, aw):
         return self.aws[aw]
@@ -44,10 +51,23 @@ class Awaitables:
     def add(self, aw, name=None):
         if aw in self.aws:
             raise ValueError('awaitable object already exist')
-        if name and name in self.aws.values():
+        if name and name in self.names:
             raise ValueError('name already exist')
         self.aws[aw] = name
-        self.aws_changed.set()
+        if name:
+            self.names[name] = aw
+        aw.add_done_callback(self._on_done)
+
+    def _on_done(self, aw):
+        if aw in self.aws:
+            self.completed.append(aw)
+            self.completion.set()
+
+    def _pop(self, aw):
+        name = self.aws.pop(aw)
+        if name:
+            del self.names[name]
+        return name
 
     def create_task(self, coro, name=None):
         task = asyncio.create_task(coro)
@@ -75,35 +95,31 @@ class Awaitables:
         except Exception:
             pass
         self.aws.clear()
+        self.names.clear()
+        self.completed.clear()
 
     async def wait(self, timeout=None):
+        completed = self.completed
         while True:
-            self.aws_changed.clear()
-            wait_aws_change = asyncio.create_task(self.aws_changed.wait())
+            while completed:
+                task = completed.popleft()
+                if task in self.aws:
+                    name = self._pop(task)
+                    try:
+                        res = task.result()
+                    except Exception as exc:
+                        raise ExecutionError(name) from exc
+                    return ExecutionResult(name, res)
+
+            self.completion.clear()
             try:
-                done, _ = await asyncio.wait(
-                    self.aws.keys() | {wait_aws_change},
-                    timeout=timeout,
-                    return_when=asyncio.FIRST_COMPLETED)
+                if timeout is None:
+                    await self.completion.wait()
+                else:
+                    await asyncio.wait_for(self.completion.wait(), timeout)
             except asyncio.CancelledError:
                 await self.cleanup()
                 raise
-            finally:
-                wait_aws_change.cancel()
-            if wait_aws_change not in done:
-                break
-
-        if not done:
-            raise asyncio.TimeoutError()
-
-        task = done.pop()
-        name = self.aws[task]
-        del self.aws[task]
-        try:
-            res = task.result()
-        except Exception as exc:
-            raise ExecutionError(name) from exc
-        return ExecutionResult(name, res)
 
 
 _default = Awaitables()
@@ -0,0 +1,112 @@
+import time
+import asyncio
+import threading
+
+
+class RequestCoalescer:
+    """合并相同的并发请求
+
+    同一个 key 的请求在途时, 后来的调用者不再发送请求, 而是等待并共享在途
+    请求的结果(或异常)。ttl 大于 0 时结果再缓存 ttl 毫秒, 期间的相同请求
+    直接返回缓存。线程(call)和协程(acall)分别合并在途请求, 共用缓存。
+
+    结果是同一个对象, 调用者不应修改它。
+    """
+
+    max_cache_size = 1024
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl / 1000
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.async_flights = {}
+        self.cache = {}
+
+    def call(self, key, fetch):
+        with self.lock:
+            found, result = self._cached(key)
+            if found:
+                return result
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+        if not leader:
+            return flight.wait()
+        try:
+            result = fetch()
+        except BaseException as e:
+            self._done(self.flights, key)
+            flight.set(None, e)
+            raise
+        self._done(self.flights, key, result)
+        flight.set(result, None)
+        return result
+
+    async def acall(self, key, fetch):
+        while True:
+            with self.lock:
+                found, result = self._cached(key)
+                if found:
+                    return result
+                future = self.async_flights.get(key)
+                if future is None:
+                    future = asyncio.get_running_loop().create_future()
+                    self.async_flights[key] = future
+                    break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # 发送请求的协程被取消, 重新发送
+
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            self._done(self.async_flights, key)
+            future.cancel()
+            raise
+        except BaseException as e:
+            self._done(self.async_flights, key)
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不必报告 'exception was never retrieved'
+            raise
+        self._done(self.async_flights, key, result)
+        future.set_result(result)
+        return result
+
+    def _cached(self, key):
+        entry = self.cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def _done(self, flights, key, *result):
+        with self.lock:
+            del flights[key]
+            if result and self.ttl > 0:
+                now = time.monotonic()
+                if len(self.cache) >= self.max_cache_size:
+                    self.cache = {k: v for k, v in self.cache.items() if v[0] > now}
+                self.cache[key] = (now + self.ttl, result[0])
+
+
+class _Flight:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def set(self, result, error):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
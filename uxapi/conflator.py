@@ -0,0 +1,62 @@
+import asyncio
+
+from uxapi import MessageQueue
+
+
+class Conflator:
+    """按频道合并消息的投递阶段
+
+    作为 WSHandler.run() 的 collector 使用: 收到的消息先放进按 key 合并的
+    队列, 由后台任务逐条交给 consumer, 每条之间让出一次事件循环。consumer
+    忙的时候同一频道的新消息覆盖尚未投递的旧消息, 只保留最新的一条;
+    key 为 None 的消息按顺序投递, 不合并。
+
+    :param consumer: 普通函数或协程函数
+    :param key: callable(msg), 通常是 WSHandler.message_key
+    :param maxsize: 待投递消息的上限, 超出时丢弃最早的消息, 0 表示不限
+    """
+
+    def __init__(self, consumer, key, maxsize=0):
+        self.consumer = consumer
+        self.is_async = asyncio.iscoroutinefunction(consumer)
+        self.queue = MessageQueue(maxsize, 'conflate', key)
+        self.task = None
+        self.exception = None
+
+    @property
+    def coalesced(self):
+        return self.queue.coalesced
+
+    @property
+    def dropped(self):
+        return self.queue.dropped
+
+    def __call__(self, msg):
+        if self.exception:
+            exc, self.exception = self.exception, None
+            raise exc
+        self.queue.put_nowait(msg)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.drain())
+
+    async def drain(self):
+        queue = self.queue
+        try:
+            while queue:
+                msg = queue.get_nowait()
+                if self.is_async:
+                    await self.consumer(msg)
+                else:
+                    self.consumer(msg)
+                    await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # 在下一次投递时抛给 WSHandler.run()
+            self.exception = exc
+        finally:
+            self.task = None
+
+    def cancel(self):
+        if self.task:
+            self.task.cancel()
@@ -1,4 +1,3 @@
-import json
 import bisect
 import asyncio
 
@@ -6,13 +5,48 @@ import pendulum
 from yarl import URL
 
 from uxapi import register_exchange
+from uxapi import jsonlib
 from uxapi import UXSymbol
 from uxapi import UXPatch
 from uxapi import Session
 from uxapi import WSHandler
-from uxapi import Awaitables
+from uxapi import OrderBookMerger
 from uxapi.exchanges.ccxt.binance import binance
-from uxapi.helpers import deep_extend, is_sorted, contract_delivery_time
+from uxapi.helpers import deep_extend, contract_delivery_time
+
+
+def _futures_rate_limits(prefix):
+    # fapi 和 dapi 的接口权重相同, 令牌桶分开计算
+    weight, orders = f'{prefix}.weight', f'{prefix}.orders'
+    by_symbol = {'symbol': {None: 40, '*': 1}}
+    public = {
+        '*': {weight: 1},
+        'GET depth': {weight: {'limit': {None: 10, 50: 2, 100: 5, 500: 10, 1000: 20}}},
+        'GET historicalTrades': {weight: 20},
+        'GET aggTrades': {weight: 20},
+        'GET klines': {weight: {'limit': {None: 5, 99: 1, 499: 2, 1000: 5, 1500: 10}}},
+        'GET ticker/24hr': {weight: by_symbol},
+        'GET ticker/price': {weight: {'symbol': {None: 2, '*': 1}}},
+        'GET ticker/bookTicker': {weight: {'symbol': {None: 2, '*': 1}}},
+    }
+    private = {
+        '*': {weight: 1},
+        'GET openOrders': {weight: by_symbol},
+        'GET allOrders': {weight: 5},
+        'GET account': {weight: 5},
+        'GET balance': {weight: 5},
+        'GET positionRisk': {weight: 5},
+        'GET userTrades': {weight: 5},
+        'GET income': {weight: 30},
+        'POST order': {weight: 1, orders: 1},
+        'POST batchOrders': {weight: 5, orders: 5},
+    }
+    return {
+        f'{prefix}Public': public,
+        f'{prefix}Private': private,
+        f'{prefix}PrivateV2': private,
+        f'{prefix}Data': {'*': {weight: 1}},
+    }
 
 
 @register_exchange('binance')
@@ -23,11 +57,60 @@ class Binance(UXPatch, binance):
                 'defaultType': market_type,
             }
         }, config or {}))
+        self._depth_fetcher = None
 
     def describe(self):
         return self.deep_extend(super().describe(), {
             'deliveryHourUTC': 8,
 
+            'rateLimits': {
+                'buckets': {
+                    'weight': [1200, 60],
+                    'orders': [100, 10],
+                    'fapi.weight': [2400, 60],
+                    'fapi.orders': [300, 10],
+                    'dapi.weight': [2400, 60],
+                    'dapi.orders': [1200, 60],
+                },
+                'endpoints': {
+                    'public': {
+                        '*': {'weight': 1},
+                        'GET depth': {'weight': {'limit': {None: 1, 100: 1, 500: 5, 1000: 10, 5000: 50}}},  # noqa: E501
+                        'GET historicalTrades': {'weight': 5},
+                        'GET exchangeInfo': {'weight': 10},
+                        'GET ticker/24hr': {'weight': {'symbol': {None: 40, '*': 1}}},
+                        'GET ticker/price': {'weight': {'symbol': {None: 2, '*': 1}}},
+                        'GET ticker/bookTicker': {'weight': {'symbol': {None: 2, '*': 1}}},
+                    },
+                    'private': {
+                        '*': {'weight': 1},
+                        'GET order': {'weight': 2},
+                        'GET openOrders': {'weight': {'symbol': {None: 40, '*': 3}}},
+                        'GET allOrders': {'weight': 10},
+                        'GET account': {'weight': 10},
+                        'GET myTrades': {'weight': 10},
+                        'GET allOrderList': {'weight': 10},
+                        'GET openOrderList': {'weight': 3},
+                        'GET orderList': {'weight': 2},
+                        'POST order': {'weight': 1, 'orders': 1},
+                        'POST order/oco': {'weight': 1, 'orders': 2},
+                    },
+                    'v3': {'*': {'weight': 1}},
+                    'sapi': {'*': {'weight': 1}},
+                    **_futures_rate_limits('fapi'),
+                    **_futures_rate_limits('dapi'),
+                },
+                'priority': {
+                    'private': ['POST order', 'POST order/oco', 'DELETE order',
+                                'DELETE openOrders', 'DELETE orderList'],
+                    **{
+                        f'{prefix}Private': ['POST order', 'POST batchOrders', 'DELETE order',
+                                             'DELETE batchOrders', 'DELETE allOpenOrders']
+                        for prefix in ('fapi', 'dapi')
+                    },
+                },
+            },
+
             'urls': {
                 'wsapi': {
                     'market': 'wss://stream.binance.com:9443/stream',
@@ -104,8 +187,17 @@ class Binance(UXPatch, binance):
                     market['deliveryTime'] = delivery_time.to_iso8601_string()
         return markets
 
-    def order_book_merger(self):
-        return BinanceOrderBookMerger(self)
+    def order_book_merger(self, session=None, **kwargs):
+        return BinanceOrderBookMerger(self, session, **kwargs)
+
+    def depth_fetcher(self, session=None):
+        fetcher = self._depth_fetcher
+        if fetcher is None:
+            limit = self.options.get('depthSnapshotConcurrency', 10)
+            fetcher = self._depth_fetcher = BinanceDepthFetcher(self, session, limit)
+        elif session and not fetcher.session:
+            fetcher.session = session
+        return fetcher
 
     def wshandler(self, topic_set):
         wsapi_types = set(self.wsapi_type(topic) for topic in topic_set)
@@ -115,6 +207,13 @@ class Binance(UXPatch, binance):
         wsurl = self.urls['wsapi'][wsapi_type]
         return BinanceWSHandler(self, wsurl, topic_set, wsapi_type)
 
+    def rest_api_type(self, market_type, api):
+        # 与 find_method 的规则一致: 'public' -> 'public' / 'fapiPublic' / 'dapiPublic'
+        if market_type.startswith(('futures', 'swap')):
+            prefix = 'fapi' if market_type.endswith('.usdt') else 'dapi'
+            return f'{prefix}{api[0].upper()}{api[1:]}'
+        return api
+
     def wsapi_type(self, uxtopic):
         if uxtopic.maintype == 'private':
             wstype = 'private'
@@ -131,7 +230,7 @@ class Binance(UXPatch, binance):
         else:
             return wstype
 
-    def convert_symbol(self, uxsymbol):
+    def _convert_symbol(self, uxsymbol):
         if uxsymbol.market_type in ('spot', 'margin'):
             return uxsymbol.name
 
@@ -203,10 +302,7 @@ class BinanceWSHandler(WSHandler):
         self.listen_key = None
 
     async def connect(self):
-        if not self.session:
-            self.session = Session()
-            self.own_session = True
-
+        self.get_session()
         if self.login_required:
             result = await self.request_listen_key('POST')
             self.listen_key = result['listenKey']
@@ -258,26 +354,51 @@ class BinanceWSHandler(WSHandler):
                 self.logger.exception('request listen key failed')
 
     def decode(self, data):
-        return json.loads(data)
-
-
-class BinanceOrderBookMerger:
-    def __init__(self, exchange):
+        return jsonlib.loads(data)
+
+    # 每次推送完整状态、可以按频道合并的 stream; 逐笔成交、增量深度、
+    # 只推送变化部分的 !xxx@arr 和私有消息都不能合并
+    snapshot_streams = ('ticker', 'miniTicker', 'bookTicker', 'markPrice', 'indexPrice')
+    kline_streams = ('kline_', 'continuousKline_', 'indexPriceKline_', 'markPriceKline_')
+
+    def message_key(self, msg):
+        stream = msg.get('stream')
+        if stream is None or stream.startswith('!'):
+            return None
+        kind = stream.split('@')[1]
+        if kind in self.snapshot_streams:
+            return stream
+        if kind.startswith('depth') and kind[5:].isdigit():
+            return stream
+        if kind.startswith(self.kline_streams):
+            # 同一根 K 线的推送才能合并, 不能丢掉上一根 K 线的最终状态
+            return f"{stream}:{msg['data']['k']['t']}"
+        return None
+
+
+class BinanceOrderBookMerger(OrderBookMerger):
+    def __init__(self, exchange, session=None, resync=False):
+        super().__init__(resync)
         self.exchange = exchange
-        self.snapshot = None
+        self.session = session
+        self.fetcher = exchange.depth_fetcher()
         self.cache = []
         self.future = None
-        self.prices = None
 
-    def __call__(self, patch):
+    @staticmethod
+    def split(msg):
+        return [(msg['data']['s'], msg)]
+
+    def process(self, patch):
         if self.snapshot:
             self.merge(patch)
             return self.snapshot
 
         self.cache.append(patch)
         if not self.future:
-            self.future = Awaitables.default().run_in_executor(
-                self.fetch_order_book, patch['data']['s'])
+            self.channel = patch['stream']
+            self.future = self.fetcher.fetch(patch['data']['s'],
+                                             session=self.rest_session())
         if not self.future.done():
             raise StopIteration
 
@@ -292,12 +413,9 @@ class BinanceOrderBookMerger:
     def on_snapshot(self, snapshot):
         self.snapshot = snapshot
         self.snapshot['lastUpdateId'] = None
-        self.prices = {
-            'asks': [float(item[0]) for item in snapshot['asks']],
-            'bids': [-float(item[0]) for item in snapshot['bids']]
-        }
-        assert is_sorted(self.prices['asks'])
-        assert is_sorted(self.prices['bids'])
+        book = self.create_book(snapshot['asks'], snapshot['bids'])
+        self.snapshot['asks'] = book.asks
+        self.snapshot['bids'] = book.bids
         for patch in self.cache:
             self.merge(patch)
         self.cache = None
@@ -308,38 +426,111 @@ class BinanceOrderBookMerger:
         if lastUpdateId:
             if 'pu' in data:   # binance futures
                 if data['pu'] != lastUpdateId:
-                    raise ValueError('invalid patch')
+                    self.on_gap(ValueError('invalid patch'), patch)
             else:   # binance spot
                 if data['U'] != lastUpdateId + 1:
-                    raise ValueError('invalid patch')
+                    self.on_gap(ValueError('invalid patch'), patch)
         self.snapshot['lastUpdateId'] = data['u']
-        self.merge_asks_bids(self.snapshot['asks'], data['a'],
-                             self.prices['asks'], False)
-        self.merge_asks_bids(self.snapshot['bids'], data['b'],
-                             self.prices['bids'], True)
-
-    def merge_asks_bids(self, snapshot_lst, patch_lst, price_lst, negative_price):
-        for item in patch_lst:
-            price, amount = float(item[0]), float(item[1])
-            if negative_price:
-                price = -price
-            i = bisect.bisect_left(price_lst, price)
-            if i != len(price_lst) and price_lst[i] == price:
-                if amount == 0:
-                    price_lst.pop(i)
-                    snapshot_lst.pop(i)
-                else:
-                    snapshot_lst[i] = item
-            else:
-                if amount != 0:
-                    price_lst.insert(i, price)
-                    snapshot_lst.insert(i, item)
+        self.merge_book(data['a'], data['b'])
 
-    def fetch_order_book(self, market_id):
+    def seqnum(self):
+        return self.snapshot['lastUpdateId']
+
+    def reset(self):
+        super().reset()
+        self.cache = []
+        self.future = None
+
+    def resync_book(self, patch):
+        # 重新走一遍 REST 快照 + 缓存 patch 的流程
+        self.process(patch)
+
+    def rest_session(self):
+        # 缺省使用 attach 的 WSHandler 的 Session, 它在 run() 时才创建
+        if self.session:
+            return self.session
+        if self.wshandler:
+            return self.wshandler.session
+        return None
+
+
+class BinanceDepthFetcher:
+    """通过 aiohttp Session 异步获取 REST 深度快照
+
+    同时进行的请求数不超过 limit, 相同的请求合并为一次, 和其他 REST 请求
+    一样计入 exchange 的 RateLimiter。fetch() 没有传入 session 时使用
+    self.session, 没有则自己创建一个, 在没有进行中的请求时关闭。Semaphore、Future 和 Session 都属于当前的事件循环, 换了
+    事件循环(如再次调用 asyncio.run())时重新创建。
+    """
+
+    def __init__(self, exchange, session=None, limit=10):
+        self.exchange = exchange
+        self.session = session
+        self.own_session = False
+        self.limit = limit
+        self.loop = None
+        self.semaphore = None
+        self.pending = {}
+        self.active = 0
+
+    def fetch(self, market_id, limit=1000, session=None):
+        self.bind_loop()
+        key = (market_id, limit)
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self.fetch_order_book(market_id, limit, session))
+            self.pending[key] = future
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        return future
+
+    async def fetch_order_book(self, market_id, limit, session=None):
+        self.bind_loop()
+        market = self.exchange.markets_by_id[market_id]
+        api = self.exchange.rest_api_type(market['type'], 'public')
         params = {
             'symbol': market_id,
-            'limit': 1000,
+            'limit': limit,
         }
-        market = self.exchange.markets_by_id[market_id]
-        method = self.exchange.find_method(market['type'], 'publicGetDepth')
-        return method(params)
+        limiter = self.exchange.get_rate_limiter()
+        cost = limiter.cost(api, 'GET', 'depth', params) if limiter else None
+        r = self.exchange.sign('depth', api, 'GET', params)
+        self.active += 1
+        try:
+            async with self.semaphore:
+                if cost:
+                    await limiter.acquire_async(*cost)
+                async with (session or self.get_session()).request(
+                        r['method'], r['url'], headers=r['headers']) as resp:
+                    result = await resp.json()
+        finally:
+            self.active -= 1
+            if not self.active:
+                await self.close()
+        if resp.status != 200:
+            raise RuntimeError(f'fetch order book failed: {result}')
+        return result
+
+    def bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.limit)
+            self.pending = {}
+            self.active = 0
+            if self.own_session:
+                # 上一个事件循环中没有进行中的请求时已经关闭
+                self.session = None
+                self.own_session = False
+
+    def get_session(self):
+        if not self.session:
+            self.session = Session()
+            self.own_session = True
+        return self.session
+
+    async def close(self):
+        if self.session and self.own_session:
+            session, self.session = self.session, None
+            self.own_session = False
+            await session.close()
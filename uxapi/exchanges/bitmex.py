@@ -1,14 +1,16 @@
 import time
 import asyncio
-import json
 import operator
+from operator import itemgetter
 
 import ccxt
 
 from uxapi import register_exchange
+from uxapi import jsonlib
 from uxapi import UXSymbol
 from uxapi import UXPatch
 from uxapi import WSHandler
+from uxapi import OrderBookMerger
 from uxapi.helpers import (
     hmac,
     contract_delivery_time
@@ -102,13 +104,13 @@ class Bitmex(UXPatch, ccxt.bitmex):
             'nonce': None
         }
 
-    def order_book_merger(self):
-        return BitmexOrderBookMerger()
+    def order_book_merger(self, **kwargs):
+        return BitmexOrderBookMerger(**kwargs)
 
     def wshandler(self, topic_set):
         return BitmexWSHandler(self, self.urls['wsapi'], topic_set)
 
-    def convert_symbol(self, uxsymbol):
+    def _convert_symbol(self, uxsymbol):
         if uxsymbol.market_type == 'swap':
             if uxsymbol.name == '!ETHUSD/BTC':
                 return 'ETH/USD'
@@ -182,6 +184,11 @@ class Bitmex(UXPatch, ccxt.bitmex):
 
 class BitmexWSHandler(WSHandler):
     default_api_expires = 60 * 60 * 24 * 1000  # 1000 days
+    private_tables = ('affiliate', 'execution', 'order', 'margin', 'position',
+                      'privateNotifications', 'transact', 'wallet')
+    # 每条消息都是完整状态、可以按频道合并的 table; instrument 等的 update
+    # 只包含变化的字段, trade 等的 insert 是新的记录, 都不能合并
+    snapshot_tables = ('quote', 'orderBook10')
 
     def on_connected(self):
         self.pre_processors.append(self.on_info_message)
@@ -271,29 +278,62 @@ class BitmexWSHandler(WSHandler):
         }
         return [command]
 
+    def unsubscribe_commands(self, topic_set):
+        command = {
+            'op': 'unsubscribe',
+            'args': list(topic_set),
+        }
+        return [command]
+
     def on_subscribe_message(self, msg):
         if 'subscribe' in msg:
             topic = msg['subscribe']
             self.logger.info(f'{topic} subscribed')
             self.on_subscribed(topic)
             raise StopIteration
+        elif 'unsubscribe' in msg:
+            raise StopIteration
         else:
             return msg
 
     def decode(self, data):
         try:
-            jsonmsg = json.loads(data)
+            jsonmsg = jsonlib.loads(data)
             return jsonmsg
-        except json.JSONDecodeError:
+        except ValueError:
             return data
 
-
-class BitmexOrderBookMerger:
-    def __init__(self):
-        self.snapshot = None
+    def message_key(self, msg):
+        if not isinstance(msg, dict):
+            return None
+        table = msg.get('table')
+        if table is None or table in self.private_tables:
+            return None
+        if table not in self.snapshot_tables or msg.get('action') == 'delete':
+            return None
+        symbols = {item.get('symbol') for item in msg['data']}
+        if len(symbols) != 1:
+            return None
+        return f'{table}:{symbols.pop()}'
+
+
+class BitmexOrderBookMerger(OrderBookMerger):
+    def __init__(self, resync=False):
+        super().__init__(resync)
         self.data = None
 
-    def __call__(self, patch):
+    @staticmethod
+    def split(msg):
+        groups = {}
+        for item in msg['data']:
+            groups.setdefault(item['symbol'], []).append(item)
+        if not groups and 'filter' in msg:
+            groups[msg['filter']['symbol']] = []
+        if len(groups) == 1:
+            return [(symbol, msg) for symbol in groups]
+        return [(symbol, dict(msg, data=data)) for symbol, data in groups.items()]
+
+    def process(self, patch):
         if patch['action'] == 'partial':
             self.on_snapshot(patch)
         elif patch['action'] in ('update', 'delete', 'insert'):
@@ -304,7 +344,10 @@ class BitmexOrderBookMerger:
 
     def on_snapshot(self, snapshot):
         self.snapshot = snapshot
-        self.data = {item['id']: item for item in snapshot['data']}
+        self.channel = f"{snapshot['table']}:{snapshot['filter']['symbol']}"
+        self.data = {}
+        self.create_book(amount=itemgetter('size'))
+        self.insert(snapshot['data'])
         self.update_snapshot()
 
     def merge(self, patch):
@@ -313,26 +356,35 @@ class BitmexOrderBookMerger:
 
         if patch['action'] == 'update':
             for item in patch['data']:
-                self.data[item['id']]['size'] = item['size']
+                level = self.get_level(item['id'])
+                level['size'] = item['size']
+                self.side(level).set(level['price'], item['size'], level)
 
         elif patch['action'] == 'delete':
             for item in patch['data']:
+                level = self.get_level(item['id'])
                 del self.data[item['id']]
+                self.side(level).set(level['price'], 0, level)
             self.update_snapshot()
 
         elif patch['action'] == 'insert':
-            self.data.update((item['id'], item) for item in patch['data'])
+            self.insert(patch['data'])
             self.update_snapshot()
 
+    def insert(self, items):
+        for item in items:
+            self.data[item['id']] = item
+            self.side(item).set(item['price'], item['size'], item)
+
     def update_snapshot(self):
-        def sortkey(item):
-            if item['side'] == 'Sell':
-                side = 0
-                price = item['price']
-            else:
-                side = 1
-                price = -item['price']
-            return side, price
+        # 卖单按价格升序在前, 买单按价格降序在后; update 只修改档位本身, 不用重建
+        self.snapshot['data'] = self.book.asks + self.book.bids
+
+    def get_level(self, id):
+        level = self.data.get(id)
+        if level is None:
+            self.on_gap(KeyError(id))
+        return level
 
-        data = sorted(self.data.values(), key=sortkey)
-        self.snapshot['data'] = data
+    def side(self, item):
+        return self.book.asks if item['side'] == 'Sell' else self.book.bids
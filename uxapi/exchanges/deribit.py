@@ -23,7 +23,7 @@ class Deribit(UXPatch, ccxt.deribit):
                 market['deliveryTime'] = delivery_time.to_iso8601_string()
         return markets
 
-    def convert_symbol(self, uxsymbol):
+    def _convert_symbol(self, uxsymbol):
         month_names = [
             '', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
             'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC',
@@ -1,7 +1,6 @@
 import datetime
 import asyncio
-import gzip
-import json
+import zlib
 import urllib.parse
 import bisect
 from urllib.parse import parse_qs
@@ -11,11 +10,14 @@ import yarl
 import pendulum
 from ccxt import huobipro
 from uxapi import register_exchange
+from uxapi import jsonlib
 from uxapi import UXSymbol
 from uxapi import WSHandler
+from uxapi import ConnectionClosed
 from uxapi import UXPatch
 from uxapi import Queue
 from uxapi import Awaitables
+from uxapi import OrderBookMerger
 from uxapi.exchanges.ccxt.huobidm import huobidm
 from uxapi.helpers import (
     keysort,
@@ -25,6 +27,9 @@ from uxapi.helpers import (
 )
 
 
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
 @register_exchange('huobi')
 class Huobi:
     def __init__(self, market_type, config):
@@ -93,8 +98,8 @@ class Huobipro(UXPatch, huobipro):
                 results.append(account)
         return results
 
-    def order_book_merger(self):
-        return HuobiproOrderBookMerger(self)
+    def order_book_merger(self, **kwargs):
+        return HuobiproOrderBookMerger(self, **kwargs)
 
     def _fetch_markets(self, params=None):
         markets = super()._fetch_markets(params)
@@ -178,43 +183,28 @@ class Huobipro(UXPatch, huobipro):
         raise ValueError('invalid topic')
 
 
-class _HuobiOrderBookMerger:
-    def merge_asks_bids(self, snapshot_lst, patch_lst, price_lst, negative_price):
-        for item in patch_lst:
-            price, amount = item
-            if negative_price:
-                price = -price
-            i = bisect.bisect_left(price_lst, price)
-            if i != len(price_lst) and price_lst[i] == price:
-                if amount == 0:
-                    price_lst.pop(i)
-                    snapshot_lst.pop(i)
-                else:
-                    snapshot_lst[i] = item
-            else:
-                if amount != 0:
-                    price_lst.insert(i, price)
-                    snapshot_lst.insert(i, item)
-
-
-class HuobiproOrderBookMerger(_HuobiOrderBookMerger):
-    def __init__(self, exchange):
+class HuobiproOrderBookMerger(OrderBookMerger):
+    def __init__(self, exchange, resync=False):
+        super().__init__(resync)
         self.exchange = exchange
-        self.snapshot = None
         self.topic = None
         self.wsreq = None
         self.wsreq_task = None
         self.future = None
         self.cache = []
-        self.prices = None
 
-    def __call__(self, patch):
+    @staticmethod
+    def split(msg):
+        # market.{symbol}.mbp.150 / market.{symbol}.depth.size_150.high_freq
+        return [(msg['ch'].split('.', 2)[1], msg)]
+
+    def process(self, patch):
         if self.snapshot:
             self.merge(patch)
             return self.snapshot
 
         if self.wsreq is None:
-            self.topic = patch['ch']
+            self.topic = self.channel = patch['ch']
             self.start_wsreq()
 
         self.cache.append(patch)
@@ -239,14 +229,14 @@ class HuobiproOrderBookMerger(_HuobiOrderBookMerger):
         raise StopIteration
 
     def on_snapshot(self, snapshot):
+        tick = snapshot['data']
         self.snapshot = {
             'ch': snapshot['rep'],
-            'tick': snapshot['data'],
-        }
-        self.prices = {
-            'asks': [item[0] for item in snapshot['data']['asks']],
-            'bids': [-item[0] for item in snapshot['data']['bids']]
+            'tick': tick,
         }
+        book = self.create_book(tick['asks'], tick['bids'])
+        tick['asks'] = book.asks
+        tick['bids'] = book.bids
         for patch in self.cache:
             self.merge(patch)
         self.cache = None
@@ -255,15 +245,22 @@ class HuobiproOrderBookMerger(_HuobiOrderBookMerger):
         snapshot_tick = self.snapshot['tick']
         patch_tick = patch['tick']
         if snapshot_tick['seqNum'] != patch_tick['prevSeqNum']:
-            raise RuntimeError('seqNum error')
+            self.on_gap(RuntimeError('seqNum error'), patch)
         snapshot_tick['seqNum'] = patch_tick['seqNum']
         snapshot_tick['ts'] = patch['ts']
-        if 'asks' in patch_tick:
-            self.merge_asks_bids(snapshot_tick['asks'], patch_tick['asks'],
-                                 self.prices['asks'], False)
-        if 'bids' in patch_tick:
-            self.merge_asks_bids(snapshot_tick['bids'], patch_tick['bids'],
-                                 self.prices['bids'], True)
+        self.merge_book(patch_tick.get('asks', ()), patch_tick.get('bids', ()))
+
+    def seqnum(self):
+        return self.snapshot['tick']['seqNum']
+
+    def reset(self):
+        super().reset()
+        self.cache = []
+        self.future = None
+
+    def resync_book(self, patch):
+        # 重新通过 HuobiWSReq 请求快照, 期间的 patch 缓存起来
+        self.process(patch)
 
     def start_wsreq(self):
         self.wsreq = HuobiWSReq(self.exchange, 'mbp')
@@ -282,6 +279,29 @@ class HuobiproOrderBookMerger(_HuobiOrderBookMerger):
         self.wsreq = None
 
 
+HUOBIDM_TRADE_ENDPOINTS = [
+    'POST order', 'POST batchorder', 'POST cancel', 'POST cancelall',
+    'POST lightning_close_position', 'POST trigger_order', 'POST trigger_cancel',
+    'POST trigger_cancelall', 'POST switch_lever_rate',
+]
+
+
+def _huobidm_rate_limits(api):
+    # 交割合约、币本位永续和 U 本位永续分别限频
+    public, query, trade = f'{api}.public', f'{api}.query', f'{api}.trade'
+    endpoints = {
+        'GET *': {public: 1},
+        'GET api_trading_status': {query: 1},
+        'POST *': {query: 1},
+    }
+    endpoints.update((key, {trade: 1}) for key in HUOBIDM_TRADE_ENDPOINTS)
+    return {
+        'buckets': {public: [800, 1], query: [72, 3], trade: [72, 3]},
+        'endpoints': {api: endpoints},
+        'priority': {api: HUOBIDM_TRADE_ENDPOINTS},
+    }
+
+
 class Huobidm(UXPatch, huobidm):
     def __init__(self, market_type, config=None):
         super().__init__(market_type, self.deep_extend({
@@ -298,6 +318,12 @@ class Huobidm(UXPatch, huobidm):
                 'cancelAllOrders': True,
             },
 
+            'rateLimits': self.deep_extend(
+                _huobidm_rate_limits('futures'),
+                _huobidm_rate_limits('swap'),
+                _huobidm_rate_limits('swapusdt'),
+            ),
+
             'urls': {
                 'wsapi': {
                     'market': {
@@ -349,8 +375,8 @@ class Huobidm(UXPatch, huobidm):
             },
         })
 
-    def order_book_merger(self):
-        return HuobidmOrderBookMerger()
+    def order_book_merger(self, **kwargs):
+        return HuobidmOrderBookMerger(**kwargs)
 
     def _fetch_markets(self, params=None):
         markets = super()._fetch_markets(params)
@@ -367,7 +393,7 @@ class Huobidm(UXPatch, huobidm):
                     market['deliveryTime'] = None
         return markets
 
-    def convert_symbol(self, uxsymbol):
+    def _convert_symbol(self, uxsymbol):
         market_type = uxsymbol.market_type
         base, quote = uxsymbol.base_quote
         if market_type == 'futures':
@@ -442,15 +468,18 @@ class Huobidm(UXPatch, huobidm):
         raise ValueError('invalid topic')
 
 
-class HuobidmOrderBookMerger(_HuobiOrderBookMerger):
-    def __init__(self):
-        self.snapshot = None
-        self.prices = None
+class HuobidmOrderBookMerger(OrderBookMerger):
+    @staticmethod
+    def split(msg):
+        # market.{symbol}.mbp.150 / market.{symbol}.depth.size_150.high_freq
+        return [(msg['ch'].split('.', 2)[1], msg)]
 
-    def __call__(self, patch):
+    def process(self, patch):
         if patch['tick']['event'] == 'snapshot':
             self.on_snapshot(patch)
         elif patch['tick']['event'] == 'update':
+            if not self.snapshot:
+                raise StopIteration
             self.merge(patch)
         else:
             raise ValueError('unexpected event')
@@ -458,27 +487,29 @@ class HuobidmOrderBookMerger(_HuobiOrderBookMerger):
 
     def on_snapshot(self, snapshot):
         self.snapshot = snapshot
-        self.prices = {
-            'asks': [item[0] for item in snapshot['tick']['asks']],
-            'bids': [-item[0] for item in snapshot['tick']['bids']]
-        }
+        self.channel = snapshot['ch']
+        tick = snapshot['tick']
+        book = self.create_book(tick['asks'], tick['bids'])
+        tick['asks'] = book.asks
+        tick['bids'] = book.bids
 
     def merge(self, patch):
         self.snapshot['ts'] = patch['ts']
         snapshot_tick = self.snapshot['tick']
         patch_tick = patch['tick']
         if snapshot_tick['version'] + 1 != patch_tick['version']:
-            raise RuntimeError('version error')
+            self.channel = patch['ch']
+            self.on_gap(RuntimeError('version error'), patch)
         snapshot_tick.update({
             'mrid': patch_tick['mrid'],
             'id': patch_tick['id'],
             'ts': patch_tick['ts'],
             'version': patch_tick['version'],
         })
-        self.merge_asks_bids(snapshot_tick['asks'], patch_tick['asks'],
-                             self.prices['asks'], False)
-        self.merge_asks_bids(snapshot_tick['bids'], patch_tick['bids'],
-                             self.prices['bids'], True)
+        self.merge_book(patch_tick['asks'], patch_tick['bids'])
+
+    def seqnum(self):
+        return self.snapshot['tick']['version']
 
 
 class HuobiWSHandler(WSHandler):
@@ -486,6 +517,7 @@ class HuobiWSHandler(WSHandler):
         super().__init__(exchange, wsurl, topic_set)
         self.wsapi_type = wsapi_type
         self.market_type = exchange.market_type
+        self.topics = {}
 
     def on_connected(self):
         if self.market_type != 'spot' and self.wsapi_type == 'private':
@@ -493,7 +525,7 @@ class HuobiWSHandler(WSHandler):
 
     def on_error_message(self, msg):
         if msg['op'] == 'close':
-            raise RuntimeError('server closed')
+            raise ConnectionClosed('server closed')
         elif msg['op'] == 'error':
             raise RuntimeError('invalid op or inner error')
         else:
@@ -612,6 +644,7 @@ class HuobiWSHandler(WSHandler):
             converted = self.convert_topic(topic)
             ch, params = self._split_params(converted)
             topics[ch] = params
+        self.topics = topics
         self.pre_processors.append(self.on_subscribe_message)
         self.pending_topics = set(topics)
         return self.awaitables.create_task(
@@ -642,8 +675,31 @@ class HuobiWSHandler(WSHandler):
                 raise StopIteration
             else:
                 raise RuntimeError(f'subscribe failed: {msg}')
+
+        if 'unsubbed' in msg or msg.get('op') == 'unsub' or msg.get('action') == 'unsub':
+            raise StopIteration
         return msg
 
+    async def send_resubscribe(self, topic):
+        topics = {topic: self.topics.get(topic, {})}
+        for command in self.unsubscribe_commands(topics):
+            await self.send(command)
+        await self.subscribe(topics)
+
+    def unsubscribe_commands(self, topics):
+        commands = []
+        for ch, params in topics.items():
+            if self.wsapi_type in ('private', 'public'):
+                if self.market_type == 'spot':
+                    request = {'action': 'unsub', 'ch': ch}
+                else:
+                    request = {'op': 'unsub', 'topic': ch}
+            else:
+                request = {'unsub': ch}
+            request.update(params)
+            commands.append(request)
+        return commands
+
     def subscribe_commands(self, topics):
         commands = []
         for ch, params in topics.items():
@@ -667,11 +723,33 @@ class HuobiWSHandler(WSHandler):
 
     def decode(self, data):
         # huobipro private return str not bytes
+        # 单个 gzip member 用 zlib 一次解压, 省去 GzipFile 的开销
         if isinstance(data, bytes):
-            msg = gzip.decompress(data).decode()
-        else:
-            msg = data
-        return json.loads(msg)
+            data = zlib.decompress(data, GZIP_WBITS)
+        return jsonlib.loads(data)
+
+    # 每次推送完整状态、可以按频道合并的 ch: market.$symbol.<kind>...
+    snapshot_channels = ('detail', 'bbo', 'ticker', 'depth')
+    kline_channels = ('kline', 'index', 'basis', 'premium_index', 'estimated_rate')
+
+    def message_key(self, msg):
+        ch = msg.get('ch')
+        if ch is None or 'tick' not in msg:
+            return None
+        parts = ch.split('.')
+        if len(parts) < 3:
+            return None
+        kind = parts[2]
+        if kind in self.kline_channels:
+            # 同一根 K 线的推送才能合并
+            return f"{ch}:{msg['tick'].get('id')}"
+        if kind == 'mbp' and parts[3:4] == ['refresh']:
+            return ch
+        if kind not in self.snapshot_channels:
+            return None
+        if msg['tick'].get('event') == 'update':   # high_freq 增量
+            return None
+        return ch
 
 
 class HuobiWSReq(HuobiWSHandler):
@@ -680,6 +758,7 @@ class HuobiWSReq(HuobiWSHandler):
         super().__init__(exchange, wsurl, None, wsapi_type)
         self.queue = Queue()
         self.future = None
+        self.req = None
         self.timeout = 10.0  # in seconds
 
     def on_prepared(self):
@@ -690,8 +769,10 @@ class HuobiWSReq(HuobiWSHandler):
 
     async def sendreq(self):
         while True:
-            self.future, req = await self.queue.get()
-            await self.send(req)
+            # 重连后重新发送未完成的请求
+            if self.future is None or self.future.done():
+                self.future, self.req = await self.queue.get()
+            await self.send(self.req)
             await asyncio.wait_for(self.future, self.timeout)
 
     def request(self, req):
@@ -1,18 +1,18 @@
-import json
 import zlib
 import time
 import asyncio
-import bisect
 from itertools import zip_longest, chain
 import binascii
 
 import pendulum
 
 from uxapi import register_exchange
+from uxapi import jsonlib
 from uxapi.exchanges.ccxt.okex import okex
 from uxapi import UXSymbol
 from uxapi import WSHandler
 from uxapi import UXPatch
+from uxapi import OrderBookMerger
 from uxapi.helpers import (
     hmac,
     deep_extend,
@@ -114,13 +114,13 @@ class Okex(UXPatch, okex):
                 market['deliveryTime'] = market['info']['delivery']
         return markets
 
-    def order_book_merger(self):
-        return OkexOrderBookMerger()
+    def order_book_merger(self, **kwargs):
+        return OkexOrderBookMerger(**kwargs)
 
     def wshandler(self, topic_set):
         return OkexWSHandler(self, self.urls['wsapi'], topic_set)
 
-    def convert_symbol(self, uxsymbol):
+    def _convert_symbol(self, uxsymbol):
         if uxsymbol.market_type in ['spot', 'margin']:
             return uxsymbol.name
 
@@ -182,6 +182,8 @@ class Okex(UXPatch, okex):
 
 
 class OkexWSHandler(WSHandler):
+    private_tables = ('order', 'account', 'position')
+
     def on_connected(self):
         self.pre_processors.append(self.on_error_message)
 
@@ -253,49 +255,131 @@ class OkexWSHandler(WSHandler):
         }
         return [command]
 
+    def unsubscribe_commands(self, topic_set):
+        command = {
+            'op': 'unsubscribe',
+            'args': list(topic_set),
+        }
+        return [command]
+
     def on_subscribe_message(self, msg):
         if msg.get('event') == 'subscribe':
             topic = msg['channel']
             self.logger.info(f'{topic} subscribed')
             self.on_subscribed(topic)
             raise StopIteration
+        elif msg.get('event') == 'unsubscribe':
+            raise StopIteration
         else:
             return msg
 
     def decode(self, data):
-        bytes_ = zlib.decompress(data, wbits=-zlib.MAX_WBITS)
-        msg = bytes_.decode()
+        # 每一帧都是独立的 raw deflate 流, 直接把 bytes 交给 JSON 解析
+        bytes_ = zlib.decompress(data, -zlib.MAX_WBITS)
         try:
-            jsonmsg = json.loads(msg)
-        except json.JSONDecodeError:
-            return msg
+            jsonmsg = jsonlib.loads(bytes_)
+        except ValueError:
+            return bytes_.decode()
         else:
             return jsonmsg
 
-
-class OkexOrderBookMerger:
-    def __init__(self):
-        self.snapshot = None
-        self.prices = None
-
-    def __call__(self, patch):
+    # 每次推送完整状态、可以按频道合并的 table
+    snapshot_tables = ('ticker', 'depth5', 'mark_price', 'price_range',
+                       'estimated_price', 'funding_rate')
+
+    def message_key(self, msg):
+        if not isinstance(msg, dict):
+            return None
+        table = msg.get('table')
+        if table is None or table.endswith(self.private_tables):
+            return None
+        channel = table.partition('/')[2]
+        candle = channel.startswith('candle')
+        if not candle and channel not in self.snapshot_tables:
+            return None
+        data = msg['data']
+        ids = {item.get('instrument_id') for item in data}
+        if len(ids) != 1:
+            return None
+        key = f'{table}:{ids.pop()}'
+        if candle:
+            # 同一根 K 线的推送才能合并
+            starts = {item['candle'][0] for item in data}
+            if len(starts) != 1:
+                return None
+            key = f'{key}:{starts.pop()}'
+        return key
+
+
+class OkexOrderBookMerger(OrderBookMerger):
+    """Okex 深度合并
+
+    :param validation: 'full' 每次重新拼接前 25 档计算 CRC32;
+        'incremental' 复用未变化档位的字符串片段, 前 25 档没有变化时
+        直接与上次的 CRC32 比较
+    :param validate_every: 每 N 次更新校验一次
+    :param validate_interval: 距离上次校验超过该秒数时校验
+
+    收到快照时总会校验; 跳过的校验不会漏掉错误,
+    出错的深度在下一次抽样校验时仍然校验失败
+    """
+
+    checksum_depth = 25
+
+    def __init__(self, validation='full', validate_every=1, validate_interval=None,
+                 resync=False):
+        super().__init__(resync)
+        if validation not in ('full', 'incremental'):
+            raise ValueError(f'invalid validation: {validation}')
+        self.validation = validation
+        self.validate_every = validate_every
+        self.validate_interval = validate_interval
+        self.pending_updates = 0
+        self.last_validation = 0.0
+        self.fragments = {}
+        self.crc32 = None
+
+    @staticmethod
+    def split(msg):
+        data = msg['data']
+        ids = {item['instrument_id'] for item in data}
+        if len(ids) == 1:
+            return [(ids.pop(), msg)]
+        return [(item['instrument_id'], dict(msg, data=[item])) for item in data]
+
+    def process(self, patch):
         if patch['action'] == 'partial':
             self.on_snapshot(patch)
+            self.pending_updates = self.validate_every
         elif patch['action'] == 'update':
+            if not self.snapshot:
+                raise StopIteration
             self.merge(patch)
+            self.pending_updates += 1
         else:
             raise ValueError('unexpected action')
-        self.validate()
+        if self.book.affects(self.checksum_depth):
+            self.crc32 = None
+        if self.validation_due():
+            self.validate()
         return self.snapshot
 
+    def validation_due(self):
+        if self.pending_updates >= self.validate_every:
+            return True
+        if self.validate_interval is not None:
+            return time.monotonic() - self.last_validation >= self.validate_interval
+        return False
+
     def on_snapshot(self, snapshot):
         data = snapshot['data'][-1]
+        self.channel = f"{snapshot['table']}:{data['instrument_id']}"
         self.snapshot = snapshot
         self.snapshot['data'] = [data]
-        self.prices = {
-            'asks': [float(item[0]) for item in data['asks']],
-            'bids': [-float(item[0]) for item in data['bids']]
-        }
+        book = self.create_book(data['asks'], data['bids'])
+        data['asks'] = book.asks
+        data['bids'] = book.bids
+        self.crc32 = None
 
     def merge(self, patch):
         snapshot_data = self.snapshot['data'][0]
@@ -303,35 +387,49 @@ class OkexOrderBookMerger:
         for patch_data in patch_data_list:
             snapshot_data['timestamp'] = patch_data['timestamp']
             snapshot_data['checksum'] = patch_data['checksum']
-            self.merge_asks_bids(snapshot_data['asks'], patch_data['asks'],
-                                 self.prices['asks'], False)
-            self.merge_asks_bids(snapshot_data['bids'], patch_data['bids'],
-                                 self.prices['bids'], True)
-
-    def merge_asks_bids(self, snapshot_lst, patch_lst, price_lst, negative_price):
-        for item in patch_lst:
-            price, amount = float(item[0]), float(item[1])
-            if negative_price:
-                price = -price
-            i = bisect.bisect_left(price_lst, price)
-            if i != len(price_lst) and price_lst[i] == price:
-                if amount == 0:
-                    price_lst.pop(i)
-                    snapshot_lst.pop(i)
-                else:
-                    snapshot_lst[i] = item
-            else:
-                if amount != 0:
-                    price_lst.insert(i, price)
-                    snapshot_lst.insert(i, item)
+            self.merge_book(patch_data['asks'], patch_data['bids'])
+
+    def seqnum(self):
+        # v3 深度数据没有序列号, 用时间戳代替
+        return self.snapshot['data'][0]['timestamp']
 
     def validate(self):
+        self.pending_updates = 0
+        if self.validate_interval is not None:
+            self.last_validation = time.monotonic()
         data = self.snapshot['data'][0]
-        asks = (item[:2] for item in data['asks'][:25])
-        bids = (item[:2] for item in data['bids'][:25])
-        items = filter(None, chain(*zip_longest(bids, asks)))
-        text = ':'.join(chain(*items))
-        crc32 = binascii.crc32(text.encode())
+        if self.validation == 'full':
+            crc32 = self.full_crc32(data)
+        else:
+            crc32 = self.incremental_crc32(data)
         checksum = data['checksum'] & 0xffffffff
         if crc32 != checksum:
-            raise RuntimeError('invalid order book data')
+            self.on_gap(RuntimeError('invalid order book data'))
+
+    def full_crc32(self, data):
+        depth = self.checksum_depth
+        asks = (item[:2] for item in data['asks'][:depth])
+        bids = (item[:2] for item in data['bids'][:depth])
+        items = filter(None, chain(*zip_longest(bids, asks)))
+        text = ':'.join(chain(*items))
+        return binascii.crc32(text.encode())
+
+    def incremental_crc32(self, data):
+        if self.crc32 is not None:
+            return self.crc32
+
+        depth = self.checksum_depth
+        cache = self.fragments
+        if len(cache) > 8 * depth:
+            cache.clear()
+        texts = []
+        for bid, ask in zip_longest(data['bids'][:depth], data['asks'][:depth]):
+            for item in (bid, ask):
+                if item is None:
+                    continue
+                entry = cache.get(item[0])
+                if entry is None or entry[0] is not item:
+                    entry = cache[item[0]] = (item, f'{item[0]}:{item[1]}')
+                texts.append(entry[1])
+        self.crc32 = binascii.crc32(':'.join(texts).encode())
+        return self.crc32
@@ -108,6 +108,24 @@ def contract_delivery_time(expiration, delivery_hour, since=None):
     raise ValueError('invalid expiration')
 
 
+def contract_rollover_time(expiration, delivery_hour, since=None):
+    """返回 contract_delivery_time 的结果下一次发生变化的时间
+
+    当周、次周合约在当周合约交割后切换, 季度、次季合约在季度合约交割前两周切换。
+
+    :param expiration: 当周合约('CW')，次周合约('NW'), 季度合约('CQ'), 次季合约('NQ')
+    :param delivery_hour: 合约交割时间(UTC)
+    :param since: 参照时间(UTC), datetime类型
+    :return: 切换时间, datetime类型; 在该时间之前 contract_delivery_time 的结果不变
+    """
+    if expiration in ('CW', 'NW'):
+        return contract_delivery_time('CW', delivery_hour, since)
+    if expiration in ('CQ', 'NQ'):
+        cq = contract_delivery_time('CQ', delivery_hour, since)
+        return cq.subtract(weeks=2)
+    raise ValueError('invalid expiration')
+
+
 _PENDULUM_UNITS = ['day', 'week', 'month', 'year', 'decade', 'century']
 _EXTENDED_UNITS = [
     'previous_week', 'next_week',
@@ -0,0 +1,53 @@
+"""可替换的 JSON 解析后端
+
+websocket 消息通过 jsonlib.loads 解析; REST 响应只在 quoteJsonNumbers 为
+False 时使用 jsonlib.loads, 否则 ccxt 要把数字保留为字符串, 仍由标准库解析。
+默认按 orjson、ujson、json 的顺序选用已安装的第一个, 也可以通过环境变量
+UXAPI_JSON_BACKEND 或 set_backend() 指定。解析失败时各后端都抛出 ValueError 的子类。
+"""
+
+import os
+import json
+
+
+_backends = {'json': json.loads}
+
+try:
+    import ujson
+except ImportError:
+    pass
+else:
+    _backends['ujson'] = ujson.loads
+
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    _backends['orjson'] = orjson.loads
+
+
+backend = None
+loads = json.loads
+
+
+def available_backends():
+    return [name for name in ('orjson', 'ujson', 'json') if name in _backends]
+
+
+def set_backend(name=None):
+    global backend, loads
+    if name is None:
+        name = available_backends()[0]
+    if name not in _backends:
+        raise ValueError(f'json backend not available: {name}')
+    backend = name
+    loads = _backends[name]
+    return name
+
+
+def get_backend():
+    return backend
+
+
+set_backend(os.getenv('UXAPI_JSON_BACKEND') or None)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import contextlib
+
+import pendulum
+
+from uxapi import jsonlib
+from uxapi.__version__ import __version__
+
+try:
+    import fcntl
+except ImportError:     # Windows 上不加锁, 各进程可能同时刷新
+    fcntl = None
+
+
+FORMAT_VERSION = 1
+
+
+class MarketCache:
+    """fetch_markets() 结果的本地磁盘缓存
+
+    缓存文件按交易所、market_type 和 REST 地址区分, 记录格式版本和 uxapi
+    版本, 版本不一致时视为失效。缓存在 ttl 秒后失效, 如果其中有合约在此
+    之前交割, 则在最早的交割时间失效。
+
+    多个进程共享同一个目录: 缓存失效时, 第一个拿到文件锁的进程刷新并原子地
+    替换缓存文件, 其他进程等待锁后直接读取新的缓存。事件循环中使用
+    try_load(), 它不等待锁, 锁被占用时抛出 BlockingIOError, 调用者过
+    retry_interval 秒后重试; 拿到的锁交给调用者, 在刷新完成后释放。
+    """
+
+    retry_interval = 0.1
+
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, exchange):
+        urls = json.dumps(exchange.urls.get('api'), sort_keys=True, default=str)
+        digest = hashlib.sha1((exchange.proxy + urls).encode()).hexdigest()[:8]
+        return os.path.join(self.directory,
+                            f'{exchange.id}-{exchange.market_type}-{digest}.json')
+
+    def load(self, exchange, fetch):
+        path = self.path(exchange)
+        markets = self.read(path)
+        if markets is not None:
+            return markets
+        with self.lock(path):
+            markets = self.read(path)
+            if markets is None:
+                markets = fetch()
+                self.write(path, markets)
+        return markets
+
+    def try_load(self, exchange, fetch, locks):
+        """不等待文件锁的 load()
+
+        locks 是调用者保存的 {path: 加锁的文件}, 在多次调用之间保持(如 run_async
+        的各次执行); 关闭文件即释放锁, 调用者在 fetch() 成功或放弃后关闭。
+        """
+        path = self.path(exchange)
+        markets = self.read(path)
+        if markets is not None:
+            return markets
+        if path not in locks:
+            locks[path] = self.acquire(path, blocking=False)
+            markets = self.read(path)
+            if markets is not None:
+                self.release(locks.pop(path))
+                return markets
+        markets = fetch()
+        self.write(path, markets)
+        return markets
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                content = jsonlib.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if (content.get('format') != FORMAT_VERSION
+                or content.get('version') != __version__
+                or content.get('expires', 0) <= time.time()):
+            return None
+        return content['markets']
+
+    def write(self, path, markets):
+        now = time.time()
+        expires = now + self.ttl
+        for market in markets:
+            delivery_time = market.get('deliveryTime')
+            if delivery_time:
+                timestamp = pendulum.parse(delivery_time).timestamp()
+                if now < timestamp < expires:
+                    expires = timestamp
+        content = {
+            'format': FORMAT_VERSION,
+            'version': __version__,
+            'created': now,
+            'expires': expires,
+            'markets': markets,
+        }
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp, path)
+
+    @contextlib.contextmanager
+    def lock(self, path):
+        f = self.acquire(path)
+        try:
+            yield
+        finally:
+            self.release(f)
+
+    def acquire(self, path, blocking=True):
+        if fcntl is None:
+            return None
+        f = open(f'{path}.lock', 'w')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    @staticmethod
+    def release(f):
+        if f is not None:
+            f.close()   # 关闭文件即释放 flock
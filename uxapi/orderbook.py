@@ -0,0 +1,343 @@
+import math
+import time
+import bisect
+import logging
+from typing import NamedTuple, Optional
+
+
+def _amount(item):
+    return float(item[1])
+
+
+class BookSide(list):
+    """订单簿的一侧(asks 或 bids)
+
+    本身就是按价格排序的原始档位(item)列表, 可以直接放进快照中(仍然是
+    list, 可以 json 序列化), 但只应通过 update()/set() 修改。keys 是并列的
+    排序键列表, bids 以负价格作为排序键, 末尾有一个 inf 哨兵; 档位用 bisect
+    定位后在两个列表上同步插入或删除。touched 记录上次 commit 以来变动过的
+    最优排序键, 用来判断前 N 档是否变化。
+    """
+
+    def __init__(self, items=(), reverse=False, amount=_amount):
+        self.reverse = reverse
+        self.amount = amount
+        self.touched = math.inf
+        levels = {}
+        for item in items:
+            price = float(item[0])
+            if float(item[1]) != 0:
+                levels[-price if reverse else price] = item
+        self.keys = sorted(levels)
+        super().__init__(levels[key] for key in self.keys)
+        self.keys.append(math.inf)
+
+    def update(self, items):
+        keys = self.keys
+        insert = self.insert
+        bisect_left = bisect.bisect_left
+        reverse = self.reverse
+        touched = self.touched
+        for item in items:
+            key = float(item[0])
+            if reverse:
+                key = -key
+            if key < touched:
+                touched = key
+            i = bisect_left(keys, key)
+            if keys[i] == key:
+                if float(item[1]) == 0:
+                    del keys[i]
+                    del self[i]
+                else:
+                    self[i] = item
+            elif float(item[1]) != 0:
+                keys.insert(i, key)
+                insert(i, item)
+        self.touched = touched
+
+    def set(self, price, amount, item):
+        key = -price if self.reverse else price
+        if key < self.touched:
+            self.touched = key
+        keys = self.keys
+        i = bisect.bisect_left(keys, key)
+        if keys[i] == key:
+            if amount == 0:
+                del keys[i]
+                del self[i]
+            else:
+                self[i] = item
+        elif amount != 0:
+            keys.insert(i, key)
+            self.insert(i, item)
+
+    def best(self):
+        return self[0] if self else None
+
+    def top(self, depth):
+        sign = -1.0 if self.reverse else 1.0
+        amount = self.amount
+        return tuple((sign * key, amount(item))
+                     for key, item in zip(self.keys[:depth], self[:depth]))
+
+    def affects(self, depth):
+        # 变动的最优档位不比第 depth 档差, 前 depth 档才可能变化
+        if self.touched == math.inf:
+            return False
+        if len(self) < depth:
+            return True
+        return self.touched <= self.keys[depth - 1]
+
+
+class OrderBook:
+    def __init__(self, asks=(), bids=(), amount=_amount):
+        self.asks = BookSide(asks, amount=amount)
+        self.bids = BookSide(bids, reverse=True, amount=amount)
+
+    def update(self, asks=(), bids=()):
+        self.asks.update(asks)
+        self.bids.update(bids)
+
+    def affects(self, depth):
+        return self.asks.affects(depth) or self.bids.affects(depth)
+
+    def clear_touched(self):
+        self.asks.touched = math.inf
+        self.bids.touched = math.inf
+
+
+class OrderBookView:
+    """订单簿前 depth 档的只读视图
+
+    asks/bids 是 (price, amount) 元组, 只在前 depth 档变化后重新生成；
+    changed 表示最近一次 patch 是否改变了这前 depth 档。
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.book = None
+        self.changed = False
+        self._asks = None
+        self._bids = None
+
+    @property
+    def asks(self):
+        if self._asks is None:
+            self._asks = self.book.asks.top(self.depth) if self.book else ()
+        return self._asks
+
+    @property
+    def bids(self):
+        if self._bids is None:
+            self._bids = self.book.bids.top(self.depth) if self.book else ()
+        return self._bids
+
+    def update(self, book):
+        if book is not self.book:
+            self.book = book
+            self.changed = True
+        else:
+            self.changed = book.affects(self.depth)
+        if self.changed:
+            self._asks = None
+            self._bids = None
+
+
+class BBOEvent(NamedTuple):
+    side: str
+    price: Optional[float]
+    amount: Optional[float]
+    seqnum: object
+
+
+class OrderBookMerger:
+    """订单簿合并器的基类
+
+    :param resync: 为 True 时, 序列号断档或校验失败不再抛出异常, 而是丢弃
+        当前状态, 缓存后续 patch, 重新获取快照后继续合并(不断开 websocket)
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, resync=False):
+        self.snapshot = None
+        self.book = None
+        self.views = []
+        self.bbo_listeners = []
+        self.bbo = {'ask': None, 'bid': None}
+        self.bbo_book = None
+        self.resync = resync
+        self.resync_started = None
+        self.wshandler = None
+        self.channel = None
+        self.metrics = {
+            'gaps': 0,
+            'resyncs': 0,
+            'last_resync_time': None,
+            'total_resync_time': 0.0,
+        }
+
+    def __call__(self, patch):
+        snapshot = self.process(patch)
+        self.commit()
+        return snapshot
+
+    def process(self, patch):
+        raise NotImplementedError
+
+    @staticmethod
+    def split(msg):
+        """把一条消息按品种拆开, 返回 (market_id, patch) 的列表"""
+        raise NotImplementedError
+
+    def on_gap(self, exc, patch=None):
+        if not self.resync:
+            raise exc
+        self.metrics['gaps'] += 1
+        if self.resync_started is None:
+            self.resync_started = time.monotonic()
+        self.logger.warning(f'{exc}, resync {self.channel}')
+        self.reset()
+        self.resync_book(patch)
+        raise StopIteration
+
+    def reset(self):
+        self.snapshot = None
+        self.book = None
+
+    def on_disconnected(self):
+        # 重连后交易所会重新推送(或需要重新获取)快照, 按一次重新同步计时
+        if self.snapshot is not None and self.resync_started is None:
+            self.resync_started = time.monotonic()
+        self.reset()
+
+    def resync_book(self, patch):
+        # 默认通过重新订阅让交易所重新推送快照
+        if self.wshandler is None:
+            raise RuntimeError('resync requires an attached wshandler')
+        self.wshandler.resubscribe(self.channel)
+
+    def commit(self):
+        book = self.book
+        if book is None:
+            return
+        for view in self.views:
+            view.update(book)
+        if self.bbo_listeners:
+            self.emit_bbo(book)
+        book.clear_touched()
+
+    def add_bbo_listener(self, listener):
+        self.bbo_listeners.append(listener)
+
+    def remove_bbo_listener(self, listener):
+        self.bbo_listeners.remove(listener)
+
+    def emit_bbo(self, book):
+        replaced = book is not self.bbo_book
+        self.bbo_book = book
+        for side, book_side in (('ask', book.asks), ('bid', book.bids)):
+            if not (replaced or book_side.affects(1)):
+                continue
+            top = book_side.top(1)
+            level = top[0] if top else None
+            if level == self.bbo[side]:
+                continue
+            self.bbo[side] = level
+            price, amount = level or (None, None)
+            event = BBOEvent(side, price, amount, self.seqnum())
+            for listener in self.bbo_listeners:
+                listener(event)
+
+    def seqnum(self):
+        return None
+
+    async def close(self):
+        """释放合并器自己创建的资源(如获取快照的 Session), WSHandler 退出时调用"""
+
+    def view(self, depth):
+        view = OrderBookView(depth)
+        if self.book:
+            view.update(self.book)
+        self.views.append(view)
+        return view
+
+    def create_book(self, asks=(), bids=(), amount=_amount):
+        self.book = OrderBook(asks, bids, amount)
+        if self.resync_started is not None:
+            elapsed = time.monotonic() - self.resync_started
+            self.resync_started = None
+            self.metrics['resyncs'] += 1
+            self.metrics['last_resync_time'] = elapsed
+            self.metrics['total_resync_time'] += elapsed
+        return self.book
+
+    def merge_book(self, asks=(), bids=()):
+        self.book.update(asks, bids)
+
+
+class OrderBookManager:
+    """多品种订单簿管理
+
+    按消息中的品种把 patch 分发给各自的合并器, 合并器在收到该品种的第一条
+    消息时创建(各品种的快照请求因此并发进行); 返回最近更新的快照, 没有
+    更新(如快照尚未就绪)时抛出 StopIteration。可以直接作为 WSHandler 的
+    collector 使用, WSHandler 会忽略 collector 抛出的 StopIteration; 在其他
+    地方调用时需要自己处理。
+
+    :param exchange: 交易所对象
+    :param wshandler: 合并器需要重新订阅时使用的 WSHandler
+    :param options: 传给 exchange.order_book_merger() 的参数
+    """
+
+    def __init__(self, exchange, wshandler=None, **options):
+        self.exchange = exchange
+        self.wshandler = wshandler
+        self.options = options
+        self.mergers = {}
+        self.split = type(exchange.order_book_merger(**options)).split
+
+    def __call__(self, msg):
+        snapshot = None
+        mergers = self.mergers
+        for market_id, patch in self.split(msg):
+            merger = mergers.get(market_id)
+            if merger is None:
+                merger = self.create_merger(market_id)
+            try:
+                snapshot = merger(patch)
+            except StopIteration:
+                continue
+        if snapshot is None:
+            raise StopIteration
+        return snapshot
+
+    def __getitem__(self, market_id):
+        return self.mergers[market_id]
+
+    def __contains__(self, market_id):
+        return market_id in self.mergers
+
+    def __iter__(self):
+        return iter(self.mergers)
+
+    def __len__(self):
+        return len(self.mergers)
+
+    def create_merger(self, market_id):
+        merger = self.exchange.order_book_merger(**self.options)
+        if self.wshandler:
+            self.wshandler.attach(merger)
+        self.mergers[market_id] = merger
+        return merger
+
+    def get(self, symbol):
+        """按 market_id 或 symbol(str/UXSymbol) 查找合并器"""
+        if isinstance(symbol, str) and symbol in self.mergers:
+            return self.mergers[symbol]
+        return self.mergers.get(self.exchange.market_id(symbol))
+
+    def book(self, symbol):
+        merger = self.get(symbol)
+        return merger.book if merger else None
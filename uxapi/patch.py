@@ -1,8 +1,83 @@
+import time
+import asyncio
+import functools
+import contextvars
+
+import aiohttp
+from ccxt.base.errors import ExchangeError, ExchangeNotAvailable, RequestTimeout
+
 from uxapi import UXSymbol
-from uxapi.helpers import extend
+from uxapi import jsonlib
+from uxapi import Session
+from uxapi.ratelimit import RateLimiter
+from uxapi.coalesce import RequestCoalescer
+from uxapi.marketcache import MarketCache
+from uxapi.helpers import extend, contract_rollover_time
+
+
+_async_call = contextvars.ContextVar('uxapi_async_call', default=None)
+
+
+class _PendingRequest(BaseException):
+    # 继承 BaseException, ccxt 方法中的 except Exception 不会拦截
+    def __init__(self, key, request, cost):
+        self.key = key
+        self.request = request
+        self.cost = cost
+
+
+class _RetryLater(BaseException):
+    # run_async 等待 delay 秒后重新执行方法
+    def __init__(self, delay):
+        self.delay = delay
+
+
+class _AsyncCall:
+    # 响应按请求在一次执行中的位置记录: 签名和参数都可能随时间变化(时间戳、
+    # 按 milliseconds() 计算的 since/end、随机的订单 id), 只核对 api/method/path
+    max_requests = 100
+
+    def __init__(self):
+        self.responses = []
+        self.position = 0
+        self.locks = {}     # 在各次执行之间保持的文件锁, 见 MarketCache.try_load
+
+    def rerun(self):
+        self.position = 0
+
+    def close(self):
+        for f in self.locks.values():
+            MarketCache.release(f)
+        self.locks.clear()
+
+    def fetch(self, key, request, cost):
+        position = self.position
+        self.position += 1
+        if position < len(self.responses):
+            recorded, response = self.responses[position]
+            if recorded != key:
+                # 不能把别的请求的响应交给它, 也不能重复发送(可能是下单)
+                raise RuntimeError(f'request {key} does not match {recorded} '
+                                   f'sent at the same position in a previous run')
+            return response
+        if len(self.responses) >= self.max_requests:
+            raise RuntimeError(f'more than {self.max_requests} requests in one call')
+        raise _PendingRequest(key, request, cost)
+
+    def record(self, key, response):
+        self.responses.append((key, response))
 
 
 class UXPatch:
+    rest_session = None
+    rate_limiter = None
+    # 合并相同的并发 GET 请求; requestCacheTTL 毫秒内的相同请求直接使用上次的响应
+    coalesceRequests = True
+    requestCacheTTL = 0
+    # 设置 marketsCacheDir 后 fetch_markets 的结果缓存在该目录, 多个进程可以共享
+    marketsCacheDir = None
+    marketsCacheTTL = 3600
+
     def __init__(self, market_type, config=None):
         super().__init__(extend({
             'id': type(self).id,
@@ -12,6 +87,11 @@ class UXPatch:
         for service, provider in service_providers.items():
             if service in self.has:
                 self.has[service] = True
+        if self.coalesceRequests:
+            self.coalescer = RequestCoalescer(self.requestCacheTTL)
+        else:
+            self.coalescer = None
+        self.symbol_cache = {}
 
     def describe(self):
         return self.deep_extend(super().describe(), {
@@ -57,26 +137,168 @@ class UXPatch:
                 'publicAPI': True,
                 'withdraw': False,
             },
+
+            'rateLimits': {},
         })
 
     def request(self, path, api='public', method='GET',
                 params=None, headers=None, body=None):
         params = params or {}
+        limiter = self.get_rate_limiter()
+        cost = limiter.cost(api, method, path, params) if limiter else None
+        call = _async_call.get()
         self.lastRestRequestTimestamp = self.milliseconds()
         r = self.sign(path, api, method, params, headers, body)
+        if call is not None:
+            return call.fetch((api, method, path), r, cost)
+        key = self.coalesce_key(r)
+        if key:
+            return self.coalescer.call(key, lambda: self._send(r, cost))
+        return self._send(r, cost)
+
+    def _send(self, r, cost):
+        if cost:
+            self.rate_limiter.acquire(*cost)
         sp = self.get_service_provider('fetch')
         if sp:
             return sp(self, r['url'], r['method'], r['headers'], r['body'])
         else:
             return self.fetch(r['url'], r['method'], r['headers'], r['body'])
 
+    async def _asend(self, r, cost):
+        if cost:
+            await self.rate_limiter.acquire_async(*cost)
+        return await self.afetch(r['url'], r['method'], r['headers'], r['body'])
+
+    def coalesce_key(self, r):
+        """可以合并的请求返回 key, 签名的请求带有时间戳, 一般不会被合并"""
+        if self.coalescer and r['method'] == 'GET':
+            return r['url'], r['body']
+        return None
+
+    async def run_async(self, method, *args, **kwargs):
+        """以协程方式执行同步的 UXPatch/ccxt 方法
+
+        方法照常构造参数并用 sign() 签名, 需要发送请求时中断执行, 请求通过
+        共享的 aiohttp Session 异步发送; 拿到响应后重新执行该方法, 已经发送过
+        的请求直接返回记录的响应, 直到方法返回。响应按请求在执行中的位置
+        取用, 参数可以每次不同(如按当前时间计算的 since), 但 api、method、
+        path 必须与上一次一致, 否则抛出 RuntimeError 而不会重复发送; 一次调用
+        最多发送 _AsyncCall.max_requests 个请求。需要等待文件锁(marketsCacheDir)
+        时也是稍后重新执行, 不阻塞事件循环; 拿到的锁保持到 run_async 返回。
+        启用限频时, 请求发送前在与同步调用共享的 RateLimiter 中等待令牌;
+        相同的并发 GET 请求只发送一次。
+        """
+        call = _AsyncCall()
+        try:
+            while True:
+                call.rerun()
+                token = _async_call.set(call)
+                try:
+                    return method(*args, **kwargs)
+                except _PendingRequest as pending:
+                    request_key, r, cost = pending.key, pending.request, pending.cost
+                except _RetryLater as retry:
+                    await asyncio.sleep(retry.delay)
+                    continue
+                finally:
+                    _async_call.reset(token)
+                key = self.coalesce_key(r)
+                if key:
+                    response = await self.coalescer.acall(key, lambda: self._asend(r, cost))
+                else:
+                    response = await self._asend(r, cost)
+                call.record(request_key, response)
+        finally:
+            call.close()
+
+    def get_rate_limiter(self):
+        """enableRateLimit 为 True 且 describe() 中有 rateLimits 时返回共享的 RateLimiter"""
+        if not self.enableRateLimit or not self.rateLimits:
+            return None
+        if not self.rate_limiter:
+            self.rate_limiter = RateLimiter.shared(self.id, self.rateLimits)
+        return self.rate_limiter
+
+    def get_rest_session(self):
+        if not self.rest_session:
+            self.rest_session = Session()
+        return self.rest_session
+
+    async def aclose(self):
+        if self.rest_session:
+            await self.rest_session.close()
+            self.rest_session = None
+
+    async def afetch(self, url, method='GET', headers=None, body=None):
+        """fetch() 的异步版本, 错误处理与 ccxt 一致"""
+        request_headers = self.prepare_request_headers(headers)
+        url = self.proxy + url
+        self.logger.debug('%s %s, Request: %s %s', method, url, request_headers, body)
+
+        request_body = body
+        session = self.get_rest_session()
+        timeout = aiohttp.ClientTimeout(total=self.timeout / 1000)
+        try:
+            async with session.request(method, url, data=body.encode() if body else None,
+                                       headers=request_headers, timeout=timeout) as resp:
+                http_response = await resp.text()
+                headers = dict(resp.headers)
+                http_status_code = resp.status
+                http_status_text = resp.reason
+        except asyncio.TimeoutError as e:
+            raise RequestTimeout(' '.join([self.id, method, url])) from e
+        except aiohttp.ClientConnectionError as e:
+            raise ExchangeNotAvailable(' '.join([self.id, method, url])) from e
+        except aiohttp.ClientError as e:
+            raise ExchangeError(' '.join([self.id, method, url])) from e
+
+        http_response = self.on_rest_response(
+            http_status_code, http_status_text, url, method, headers,
+            http_response, request_headers, request_body)
+        json_response = self.parse_json(http_response)
+        if self.enableLastHttpResponse:
+            self.last_http_response = http_response
+        if self.enableLastResponseHeaders:
+            self.last_response_headers = headers
+        if self.enableLastJsonResponse:
+            self.last_json_response = json_response
+        self.logger.debug('%s %s, Response: %s %s %s', method, url,
+                          http_status_code, headers, http_response)
+
+        self.handle_errors(http_status_code, http_status_text, url, method, headers,
+                           http_response, json_response, request_headers, request_body)
+        self.handle_http_status_code(http_status_code, http_status_text, url, method,
+                                     http_response)
+        if json_response is not None:
+            return json_response
+        return http_response
+
+    def on_json_response(self, response_body):
+        # quoteJsonNumbers 为 True 时 ccxt 把数字解析为字符串, 只能用标准库
+        if self.quoteJsonNumbers:
+            return super().on_json_response(response_body)
+        return jsonlib.loads(response_body)
+
     def fetch_markets(self, params=None):
         params = params or {}
         sp = self.get_service_provider('fetchMarkets')
         if sp:
-            return sp(self, params)
-        else:
-            return self._fetch_markets(params)
+            fetch = functools.partial(sp, self, params)
+        else:
+            fetch = functools.partial(self._fetch_markets, params)
+        if self.marketsCacheDir and not params:
+            cache = MarketCache(self.marketsCacheDir, self.marketsCacheTTL)
+            call = _async_call.get()
+            if call is None:
+                return cache.load(self, fetch)
+            # run_async 中不能阻塞事件循环等待文件锁, 锁被占用时稍后重新执行;
+            # 拿到的锁保存在 call 上, 等待响应期间也不释放, 直到 run_async 返回
+            try:
+                return cache.try_load(self, fetch, call.locks)
+            except BlockingIOError:
+                raise _RetryLater(cache.retry_interval)
+        return fetch()
 
     def _fetch_markets(self, params):
         return super().fetch_markets(params)
@@ -380,6 +602,71 @@ class UXPatch:
             symbol = None
         return super().fetch_my_trades(symbol, since, limit, params)
 
+    async def aload_markets(self, reload=False, params=None):
+        return await self.run_async(self.load_markets, reload, params or {})
+
+    async def afetch_markets(self, params=None):
+        return await self.run_async(self.fetch_markets, params)
+
+    async def afetch_currencies(self, params=None):
+        return await self.run_async(self.fetch_currencies, params)
+
+    async def afetch_ticker(self, symbol, params=None):
+        return await self.run_async(self.fetch_ticker, symbol, params)
+
+    async def afetch_tickers(self, symbols=None, params=None):
+        return await self.run_async(self.fetch_tickers, symbols, params)
+
+    async def afetch_order_book(self, symbol, limit=None, params=None):
+        return await self.run_async(self.fetch_order_book, symbol, limit, params)
+
+    async def afetch_l2_order_book(self, symbol, limit=None, params=None):
+        return await self.run_async(self.fetch_l2_order_book, symbol, limit, params)
+
+    async def afetch_order_books(self, symbols=None, params=None):
+        return await self.run_async(self.fetch_order_books, symbols, params)
+
+    async def afetch_ohlcv(self, symbol, timeframe='1m', since=None,
+                           limit=None, params=None):
+        return await self.run_async(self.fetch_ohlcv, symbol, timeframe, since, limit, params)
+
+    async def afetch_trades(self, symbol, since=None, limit=None, params=None):
+        return await self.run_async(self.fetch_trades, symbol, since, limit, params)
+
+    async def afetch_order(self, id, symbol=None, params=None):
+        return await self.run_async(self.fetch_order, id, symbol, params)
+
+    async def afetch_orders(self, symbol=None, since=None, limit=None, params=None):
+        return await self.run_async(self.fetch_orders, symbol, since, limit, params)
+
+    async def afetch_open_orders(self, symbol=None, since=None, limit=None, params=None):
+        return await self.run_async(self.fetch_open_orders, symbol, since, limit, params)
+
+    async def afetch_closed_orders(self, symbol=None, since=None, limit=None,
+                                   params=None):
+        return await self.run_async(self.fetch_closed_orders, symbol, since, limit, params)
+
+    async def acreate_order(self, symbol, type, side, amount, price=None, params=None):
+        return await self.run_async(self.create_order, symbol, type, side, amount, price, params)
+
+    async def acancel_order(self, id, symbol=None, params=None):
+        return await self.run_async(self.cancel_order, id, symbol, params)
+
+    async def acancel_orders(self, ids, symbol=None, params=None):
+        return await self.run_async(self.cancel_orders, ids, symbol, params)
+
+    async def acancel_all_orders(self, symbol=None, params=None):
+        return await self.run_async(self.cancel_all_orders, symbol, params)
+
+    async def aedit_order(self, id, symbol=None, *args):
+        return await self.run_async(self.edit_order, id, symbol, *args)
+
+    async def afetch_my_trades(self, symbol=None, since=None, limit=None, params=None):
+        return await self.run_async(self.fetch_my_trades, symbol, since, limit, params)
+
+    async def afetch_balance(self, params=None):
+        return await self.run_async(self.fetch_balance, params or {})
+
     def to_uxsymbol(self, symbol):
         assert symbol, 'symbol is None'
         if isinstance(symbol, UXSymbol):
@@ -388,6 +675,26 @@ class UXPatch:
             return UXSymbol(self.id, self.market_type, symbol)
 
     def convert_symbol(self, uxsymbol):
+        """UXSymbol 转换为交易所的 symbol, 结果缓存到下一次合约切换"""
+        key = (uxsymbol.name, uxsymbol.market_type)
+        entry = self.symbol_cache.get(key)
+        now = time.time()
+        if entry and now < entry[1]:
+            return entry[0]
+        # 先算失效时间: 两次取当前时间之间恰好切换合约时, 缓存的是新合约,
+        # 或者旧合约但已经失效, 不会把旧合约缓存到下一次切换
+        name_info = uxsymbol.name_info
+        if len(name_info) > 1 and name_info[1] in ('CW', 'NW', 'CQ', 'NQ'):
+            delivery_hour = getattr(self, 'deliveryHourUTC', 0)
+            rollover = contract_rollover_time(name_info[1], delivery_hour)
+            expires = rollover.timestamp()
+        else:
+            expires = float('inf')
+        symbol = self._convert_symbol(uxsymbol)
+        self.symbol_cache[key] = (symbol, expires)
+        return symbol
+
+    def _convert_symbol(self, uxsymbol):
         return uxsymbol.name
 
     def convert_topic(self, uxtopic):
@@ -8,3 +8,75 @@ class Pipeline:
                 v = processor(v)
             except StopIteration:
                 break
+
+
+def _identity(msg):
+    return msg
+
+
+class ProcessorChain:
+    """WSHandler 的预处理器链
+
+    每次增删处理器时重新生成 dispatch 函数 (连接/登录/订阅各个阶段各一个),
+    收到消息时直接调用 dispatch, 不再逐条 rewind/next 遍历列表。
+    处理器抛出 StopIteration 表示丢弃该消息, 数据消息不会走到这个分支。
+
+    dispatch 整体替换, 处理器在执行中修改链 (如订阅完成后移除自己)
+    只影响下一条消息, 当前消息继续按旧的链处理完。
+    """
+
+    def __init__(self, processors=()):
+        self.processors = ()
+        self.dispatch = _identity
+        self.swap(processors)
+
+    def __call__(self, msg):
+        return self.dispatch(msg)
+
+    def __len__(self):
+        return len(self.processors)
+
+    def __iter__(self):
+        return iter(self.processors)
+
+    def __contains__(self, processor):
+        return processor in self.processors
+
+    def swap(self, processors):
+        processors = tuple(processors)
+        dispatch = self.compile(processors)
+        self.processors = processors
+        self.dispatch = dispatch
+
+    @staticmethod
+    def compile(processors):
+        if not processors:
+            return _identity
+        if len(processors) == 1:
+            return processors[0]
+        if len(processors) == 2:
+            first, second = processors
+
+            def dispatch(msg):
+                return second(first(msg))
+            return dispatch
+
+        def dispatch(msg):
+            for processor in processors:
+                msg = processor(msg)
+            return msg
+        return dispatch
+
+    def prepend(self, processor):
+        self.swap((processor,) + self.processors)
+
+    def append(self, processor):
+        self.swap(self.processors + (processor,))
+
+    def remove(self, processor):
+        processors = list(self.processors)
+        processors.remove(processor)
+        self.swap(processors)
+
+    def clear(self):
+        self.swap(())
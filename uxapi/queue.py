@@ -1,4 +1,8 @@
 import asyncio
+import itertools
+from collections import OrderedDict
+
+from uxapi.event import Event
 
 
 class Queue:
@@ -14,3 +18,78 @@ class Queue:
 
     def __getattr__(self, attr):
         return getattr(self.queue_obj, attr)
+
+
+class MessageQueue:
+    """有界消息队列, 用于把 websocket 收到的消息交给较慢的消费者
+
+    :param maxsize: 最大长度, 0 表示不限
+    :param overflow: 队列满时的处理方式
+        'block': put() 等待消费者取走消息(反压到 socket 读取);
+        'drop-oldest': 丢弃最早的消息;
+        'conflate': 同一个 key 只保留最新的一条(保持原来的位置),
+            没有可合并的消息时丢弃最早的消息
+    :param key: 'conflate' 使用的 callable(msg), 返回 None 的消息不合并
+    """
+
+    def __init__(self, maxsize=0, overflow='block', key=None):
+        if overflow not in ('block', 'drop-oldest', 'conflate'):
+            raise ValueError(f'invalid overflow policy: {overflow}')
+        if overflow == 'conflate' and key is None:
+            raise ValueError('conflate requires a key function')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.key = key
+        self.items = OrderedDict()
+        self.counter = itertools.count()
+        self.not_empty = Event()
+        self.not_full = Event()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self.items)
+
+    def put_nowait(self, msg):
+        items = self.items
+        key = None
+        if self.overflow == 'conflate':
+            key = self.key(msg)
+            if key is not None and key in items:
+                items[key] = msg
+                self.coalesced += 1
+                return
+        if key is None:
+            key = next(self.counter)
+        if self.full():
+            if self.overflow == 'block':
+                raise asyncio.QueueFull
+            items.popitem(last=False)
+            self.dropped += 1
+        items[key] = msg
+        self.not_empty.set()
+
+    async def put(self, msg):
+        while self.overflow == 'block' and self.full():
+            self.not_full.clear()
+            await self.not_full.wait()
+        self.put_nowait(msg)
+
+    def get_nowait(self):
+        if not self.items:
+            raise asyncio.QueueEmpty
+        _, msg = self.items.popitem(last=False)
+        self.not_full.set()
+        return msg
+
+    async def get(self):
+        while not self.items:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        return self.get_nowait()
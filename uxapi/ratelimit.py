@@ -0,0 +1,144 @@
+import time
+import asyncio
+import threading
+
+
+class RateLimiter:
+    """客户端限频, 同一交易所的所有实例、线程和协程共享一组令牌桶
+
+    令牌桶和各接口的权重来自 describe() 中的 rateLimits::
+
+        'rateLimits': {
+            # 令牌桶: [容量, 补满所需秒数]
+            'buckets': {'weight': [1200, 60], 'orders': [100, 10]},
+            # 普通请求至少为优先请求保留的令牌比例
+            'reserve': 0.2,
+            # api -> 接口 -> 各令牌桶的消耗, 接口按 'METHOD path',
+            # 'METHOD *', '*' 的顺序查找, 没有配置的接口不限频
+            'endpoints': {
+                'public': {
+                    '*': {'weight': 1},
+                    # 权重随参数变化: None 对应未传该参数, '*' 对应传了该参数,
+                    # 数值按参数值所在的区间取值
+                    'GET depth': {'weight': {'limit': {None: 1, 100: 1, 500: 5}}},
+                },
+                'private': {'POST order': {'weight': 1, 'orders': 1}},
+            },
+            # 下单、撤单等优先的接口
+            'priority': {'private': ['POST order', 'DELETE order']},
+        }
+
+    优先请求立即扣除令牌(余额可以为负), 等待到余额回到 0 后发出; 普通请求要等
+    扣除后的余额不低于保留的令牌才会发出, 因此不会挤占下单和撤单的额度。
+    """
+
+    registry = {}
+    registry_lock = threading.Lock()
+
+    def __init__(self, config):
+        self.endpoints = config.get('endpoints', {})
+        self.priority = {api: set(keys) for api, keys in config.get('priority', {}).items()}
+        reserve = config.get('reserve', 0.2)
+        now = time.monotonic()
+        self.buckets = {}
+        for name, (capacity, interval) in config['buckets'].items():
+            self.buckets[name] = _Bucket(capacity, capacity / interval, capacity * reserve, now)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, key, config):
+        with cls.registry_lock:
+            limiter = cls.registry.get(key)
+            if limiter is None:
+                limiter = cls.registry[key] = cls(config)
+            return limiter
+
+    def cost(self, api, method, path, params):
+        """返回 (各令牌桶的消耗, 是否优先), 不需要限频时返回 None"""
+        endpoints = self.endpoints.get(api)
+        if not endpoints:
+            return None
+        key = f'{method} {path}'
+        spec = endpoints.get(key) or endpoints.get(f'{method} *') or endpoints.get('*')
+        if not spec:
+            return None
+        costs = {bucket: _weight(weight, params) for bucket, weight in spec.items()}
+        return costs, key in self.priority.get(api, ())
+
+    def reserve(self, costs, priority=False):
+        """尝试扣除令牌, 返回发出请求前需要等待的秒数
+
+        优先请求总是扣除成功, 返回 0 以外的值时等待后即可发出; 普通请求
+        返回 0 表示已扣除, 否则等待后需要再次调用。
+        """
+        with self.lock:
+            now = time.monotonic()
+            buckets = []
+            for name, cost in costs.items():
+                bucket = self.buckets[name]
+                bucket.refill(now)
+                buckets.append((bucket, cost))
+            if priority:
+                delay = 0
+                for bucket, cost in buckets:
+                    bucket.tokens -= cost
+                    if bucket.tokens < 0:
+                        delay = max(delay, -bucket.tokens / bucket.rate)
+                return delay
+            delay = 0
+            for bucket, cost in buckets:
+                needed = min(cost + bucket.reserve, bucket.capacity)
+                if bucket.tokens < needed:
+                    delay = max(delay, (needed - bucket.tokens) / bucket.rate)
+            if delay == 0:
+                for bucket, cost in buckets:
+                    bucket.tokens -= cost
+            return delay
+
+    def acquire(self, costs, priority=False):
+        while True:
+            delay = self.reserve(costs, priority)
+            if delay:
+                time.sleep(delay)
+            if priority or not delay:
+                return
+
+    async def acquire_async(self, costs, priority=False):
+        while True:
+            delay = self.reserve(costs, priority)
+            if delay:
+                await asyncio.sleep(delay)
+            if priority or not delay:
+                return
+
+
+class _Bucket:
+    __slots__ = ('capacity', 'rate', 'reserve', 'tokens', 'updated')
+
+    def __init__(self, capacity, rate, reserve, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.reserve = reserve
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+def _weight(weight, params):
+    if not isinstance(weight, dict):
+        return weight
+    (name, table), = weight.items()
+    value = params.get(name)
+    if value is None:
+        return table[None]
+    if '*' in table:
+        return table['*']
+    bounds = sorted(k for k in table if k is not None)
+    value = float(value)
+    for bound in bounds:
+        if value <= bound:
+            return table[bound]
+    return table[bounds[-1]]
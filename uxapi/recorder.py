@@ -0,0 +1,216 @@
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+
+from aiohttp import WSMsgType, WSMessage
+
+from uxapi import ExecutionError, Session
+
+
+MAGIC = b'UXFRAME1'
+_BLOCK = struct.Struct('<BII')      # flags, stored size, raw size
+_RECORD = struct.Struct('<dBI')     # 接收时间, 类型, 长度
+_COMPRESSED = 0x01
+_BINARY = 0
+_TEXT = 1
+
+
+class FrameRecorder:
+    """把 WSHandler 收到的原始帧连同接收时间追加写入文件::
+
+        wshandler.recorder = FrameRecorder('okex.frames')
+
+    帧先缓存在内存中, 攒够 block_size 字节或距上次写入超过 flush_interval
+    秒后作为一个块写入(compress 为 True 时用 zlib 压缩), 进程异常退出时
+    最多丢失最后一个块。文件只追加, 同一个文件可以多次录制。
+    """
+
+    def __init__(self, path, compress=True, block_size=1 << 16, flush_interval=1.0):
+        self.path = path
+        self.compress = compress
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+        self.frames = 0
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def write(self, data, timestamp=None):
+        if isinstance(data, str):
+            kind, data = _TEXT, data.encode()
+        else:
+            kind = _BINARY
+        if timestamp is None:
+            timestamp = time.time()
+        self.buffer += _RECORD.pack(timestamp, kind, len(data))
+        self.buffer += data
+        self.frames += 1
+        if (len(self.buffer) >= self.block_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        raw = bytes(self.buffer)
+        self.buffer.clear()
+        if self.compress:
+            stored, flags = zlib.compress(raw), _COMPRESSED
+        else:
+            stored, flags = raw, 0
+        self.file.write(_BLOCK.pack(flags, len(stored), len(raw)))
+        self.file.write(stored)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FrameReplayer:
+    """回放 FrameRecorder 录制的文件
+
+    迭代得到 (接收时间, 原始帧); replay() 用文件代替 websocket 连接运行
+    WSHandler, decode、预处理器和 collector(如 OrderBookManager, 与在线时
+    一样, 它抛出的 StopIteration 被忽略)都按在线时的流程执行, 发送的命令
+    被丢弃。
+
+    :param use_mmap: 以内存映射的方式读取, 逐块解压, 不需要把整个文件读入内存
+    :param speed: None 表示尽快回放, 1.0 按原始节奏, 2.0 两倍速, 依此类推
+
+    需要登录的 WSHandler 仍然会检查 credentials; Binance 的深度快照来自 REST,
+    不在录制文件中。
+    """
+
+    def __init__(self, path, use_mmap=True):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.frames = 0
+        self.finished = False
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            if self.use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    yield from self._records(buf)
+            else:
+                yield from self._records(f.read())
+
+    def _records(self, buf):
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'not a frame file: {self.path}')
+        pos = len(MAGIC)
+        end = len(buf)
+        while pos + _BLOCK.size <= end:
+            flags, stored, raw = _BLOCK.unpack_from(buf, pos)
+            pos += _BLOCK.size
+            if pos + stored > end:
+                break   # 录制中断时最后一个块可能不完整
+            block = buf[pos:pos + stored]
+            pos += stored
+            if flags & _COMPRESSED:
+                block = zlib.decompress(block, bufsize=raw)
+            yield from self._frames(block)
+
+    @staticmethod
+    def _frames(block):
+        pos = 0
+        size = len(block)
+        unpack_from = _RECORD.unpack_from
+        while pos < size:
+            timestamp, kind, length = unpack_from(block, pos)
+            pos += _RECORD.size
+            data = block[pos:pos + length]
+            pos += length
+            yield timestamp, (data.decode() if kind == _TEXT else data)
+
+    async def replay(self, wshandler, collector=None, speed=None):
+        """把录制的帧交给 wshandler 处理, 返回回放的帧数"""
+        self.frames = 0
+        self.finished = False
+        session = wshandler.session = _ReplaySession(self, speed)
+        wshandler.own_session = False
+        wshandler.reconnect = False
+        try:
+            await wshandler.run(collector)
+        except ExecutionError:
+            if not self.finished:
+                raise
+        finally:
+            await session.close()
+        return self.frames
+
+
+class _ReplaySession:
+    # websocket 连接从文件回放, 其他请求(如 Binance 的 REST 深度快照)
+    # 交给真正的 Session
+    def __init__(self, replayer, speed):
+        self.replayer = replayer
+        self.speed = speed
+        self.session = None
+
+    def __getattr__(self, attr):
+        if self.session is None:
+            self.session = Session()
+        return getattr(self.session, attr)
+
+    async def ws_connect(self, url, **kwargs):
+        return _ReplayWebSocket(self.replayer, self.speed)
+
+    async def close(self):
+        if self.session:
+            session, self.session = self.session, None
+            await session.close()
+
+
+class _ReplayWebSocket:
+    # 回放时代替 aiohttp 的 ClientWebSocketResponse
+    yield_every = 256
+
+    def __init__(self, replayer, speed):
+        self.replayer = replayer
+        self.speed = speed
+        self.frames = iter(replayer)
+        self.start = None
+
+    async def receive(self):
+        replayer = self.replayer
+        try:
+            timestamp, data = next(self.frames)
+        except StopIteration:
+            replayer.finished = True
+            return WSMessage(WSMsgType.CLOSED, None, None)
+        replayer.frames += 1
+        if self.speed:
+            loop = asyncio.get_running_loop()
+            if self.start is None:
+                self.start = (timestamp, loop.time())
+            first, started = self.start
+            delay = started + (timestamp - first) / self.speed - loop.time()
+            await asyncio.sleep(max(delay, 0))
+        elif replayer.frames % self.yield_every == 0:
+            # 让 subscribe 等 task 也有机会运行
+            await asyncio.sleep(0)
+        kind = WSMsgType.TEXT if isinstance(data, str) else WSMsgType.BINARY
+        return WSMessage(kind, data, None)
+
+    async def send_json(self, data):
+        pass
+
+    async def send_str(self, data):
+        pass
+
+    async def close(self):
+        self.frames.close()
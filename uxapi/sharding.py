@@ -0,0 +1,165 @@
+import math
+import zlib
+import asyncio
+import logging
+import functools
+
+from uxapi import Session
+from uxapi import WSHandler
+
+
+class ShardedWSHandler:
+    """把一组 topic 分散到多个 websocket 连接上
+
+    每个分片是 exchange.wshandler() 创建的普通 WSHandler (各自断线重连),
+    所有分片共用一个 Session, 收到的消息都交给同一个 collector, 对调用者
+    来说和单个 WSHandler 一样。
+
+    :param exchange: 交易所对象
+    :param topic_set: UXTopic 集合, 可以包含不同 wsapi_type 的 topic
+    :param shards: 每个 wsapi_type 的连接数
+    :param max_topics: 每个连接的最大 topic 数, 给出时按需增加连接数
+    :param policy: 分片策略
+        'count': 按数量平均分配;
+        'rate': 按估计的消息速率做贪心装箱, 使各连接负载接近;
+        'hash': 按 topic 的 crc32 取模, 同一个 topic 总是分到同一个连接;
+        'symbol': 按品种的 crc32 取模, 同一个品种的 topic 分到同一个连接
+    :param rates: 'rate' 策略使用的估计速率, dict 或 callable(UXTopic),
+        缺省按 datatype 查 default_rates
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # 每秒消息数的粗略估计
+    default_rates = {
+        'orderbook': 10.0,
+        'trade': 5.0,
+        'aggTrade': 5.0,
+        'quote': 5.0,
+        'ohlcv': 1.0,
+        'ticker': 1.0,
+        'miniTicker': 1.0,
+    }
+    default_rate = 1.0
+
+    def __init__(self, exchange, topic_set, shards=1, max_topics=None,
+                 policy='count', rates=None):
+        if policy not in ('count', 'rate', 'hash', 'symbol'):
+            raise ValueError(f'invalid policy: {policy}')
+        self.exchange = exchange
+        self.topic_set = topic_set
+        self.policy = policy
+        self.rates = rates
+        self.session = None
+        self.mergers = []
+        self.handlers = []
+        self.channels = {}
+        for topics in self.group(topic_set).values():
+            n = shards
+            if max_topics:
+                n = max(n, math.ceil(len(topics) / max_topics))
+            for shard in self.partition(topics, n):
+                if shard:
+                    self.add_shard(shard)
+
+    @property
+    def metrics(self):
+        metrics = {
+            'reconnects': 0,
+            'total_downtime': 0.0,
+        }
+        for handler in self.handlers:
+            metrics['reconnects'] += handler.metrics['reconnects']
+            metrics['total_downtime'] += handler.metrics['total_downtime']
+        metrics['shards'] = [handler.metrics for handler in self.handlers]
+        return metrics
+
+    def group(self, topic_set):
+        # binance/huobi 的一个连接只能订阅同一种 wsapi_type
+        groups = {}
+        wsapi_type = getattr(self.exchange, 'wsapi_type', None)
+        for topic in sorted(topic_set, key=str):
+            key = wsapi_type(topic) if wsapi_type else None
+            groups.setdefault(key, []).append(topic)
+        return groups
+
+    def partition(self, topics, n):
+        shards = [[] for _ in range(n)]
+        if self.policy == 'count':
+            for i, topic in enumerate(topics):
+                shards[i % n].append(topic)
+        elif self.policy == 'hash':
+            for topic in topics:
+                shards[zlib.crc32(str(topic).encode()) % n].append(topic)
+        elif self.policy == 'symbol':
+            for topic in topics:
+                shards[zlib.crc32(topic.extrainfo.encode()) % n].append(topic)
+        else:
+            loads = [0.0] * n
+            for topic in sorted(topics, key=self.rate, reverse=True):
+                i = loads.index(min(loads))
+                shards[i].append(topic)
+                loads[i] += self.rate(topic)
+        return shards
+
+    def rate(self, topic):
+        rates = self.rates
+        if callable(rates):
+            return rates(topic)
+        if rates and topic in rates:
+            return rates[topic]
+        return self.default_rates.get(topic.maintype, self.default_rate)
+
+    def add_shard(self, topics):
+        return self.add_handler(self.exchange.wshandler(set(topics)))
+
+    def add_handler(self, handler):
+        handler.on_disconnected = functools.partial(self.on_shard_disconnected, handler)
+        for topic in handler.topic_set:
+            channel, *_ = handler.convert_topic(topic).split('?', maxsplit=1)
+            self.channels[channel] = handler
+        self.handlers.append(handler)
+        return handler
+
+    async def run(self, collector=None):
+        self.session = Session()
+        for handler in self.handlers:
+            handler.session = self.session
+        tasks = [asyncio.ensure_future(handler.run(collector))
+                 for handler in self.handlers]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.cleanup()
+
+    async def cleanup(self):
+        for merger in self.mergers:
+            await merger.close()
+        if self.session:
+            try:
+                await self.session.close()
+            except Exception:
+                pass
+            self.session = None
+
+    stream = WSHandler.stream
+    conflate = WSHandler.conflate
+
+    def message_key(self, msg):
+        return self.handlers[0].message_key(msg)
+
+    def attach(self, merger):
+        merger.wshandler = self
+        self.mergers.append(merger)
+        return merger
+
+    def resubscribe(self, topic):
+        return self.channels[topic].resubscribe(topic)
+
+    def on_shard_disconnected(self, handler):
+        for merger in self.mergers:
+            if self.channels.get(merger.channel) is handler:
+                merger.on_disconnected()
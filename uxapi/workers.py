@@ -0,0 +1,353 @@
+import os
+import asyncio
+import logging
+import threading
+import functools
+import itertools
+import collections
+import traceback
+import multiprocessing
+from typing import NamedTuple
+
+import uxapi
+from uxapi.sharding import ShardedWSHandler
+from uxapi.orderbook import OrderBookManager
+
+
+class BookUpdate(NamedTuple):
+    market_id: str
+    asks: tuple
+    bids: tuple
+    seqnum: object
+
+
+class _WorkerMetrics(NamedTuple):
+    metrics: dict
+
+
+class ProcessPoolWSHandler(ShardedWSHandler):
+    """在多个工作进程中接收、解码并合并行情
+
+    topic 按品种(缺省)分到 processes 个工作进程, 每个进程有自己的事件循环,
+    负责连接、解码、心跳以及订单簿合并; 'orderbook.full' 只把前 depth 档
+    变化后的 BookUpdate 发回主进程, 其他 topic 发回解码后的消息。主进程的
+    collector 收到的是所有进程合并后的消息流, 可以是普通函数或协程函数
+    (如 stream() 使用的 MessageQueue.put); 协程 collector 处理不过来时暂停
+    读取工作进程的管道。BookUpdate 是前 depth 档的完整快照, conflate()
+    按 market_id 合并; 工作进程在写线程中发送, 主进程读得慢时不阻塞工作进程
+    的事件循环, 尚未发出的 BookUpdate 按 market_id 只保留最新的一条。订单簿合并器在工作进程中运行, 不支持 attach()。
+
+    :param exchange: 交易所对象, 工作进程按它的 id/market_type 重新创建
+    :param topic_set: UXTopic 集合
+    :param processes: 工作进程数, 缺省为 CPU 个数
+    :param depth: BookUpdate 的档数
+    :param config: 传给工作进程中 new_exchange() 的配置, 缺省带上 API 密钥
+    :param policy/rates: 参见 ShardedWSHandler
+    """
+
+    logger = logging.getLogger(__name__)
+    credential_keys = ('apiKey', 'secret', 'password', 'uid')
+    max_backlog = 64    # 协程 collector 积压的批数, 超过时暂停读取
+
+    def __init__(self, exchange, topic_set, processes=None, depth=20,
+                 config=None, policy='symbol', rates=None):
+        self.depth = depth
+        self.partitions = []
+        if config is None:
+            config = {key: getattr(exchange, key) for key in self.credential_keys
+                      if getattr(exchange, key, None)}
+        self.config = config
+        super().__init__(exchange, topic_set, shards=processes or os.cpu_count(),
+                         policy=policy, rates=rates)
+        self.worker_metrics = [None] * len(self.partitions)
+        self.key_handler = None
+        self.readers = []
+        self.backlog = None
+        self.paused = False
+
+    @property
+    def metrics(self):
+        # 各工作进程每秒检查一次, 有变化时汇报
+        metrics = {
+            'reconnects': 0,
+            'total_downtime': 0.0,
+        }
+        for worker in self.worker_metrics:
+            if worker:
+                metrics['reconnects'] += worker['reconnects']
+                metrics['total_downtime'] += worker['total_downtime']
+        metrics['workers'] = list(self.worker_metrics)
+        return metrics
+
+    def message_key(self, msg):
+        if isinstance(msg, BookUpdate):
+            return msg.market_id
+        if self.key_handler is None:
+            topics = [topic for topic in sorted(self.topic_set, key=str)
+                      if topic.datatype != 'orderbook.full']
+            if not topics:
+                return None
+            self.key_handler = self.exchange.wshandler({topics[0]})
+        return self.key_handler.message_key(msg)
+
+    def attach(self, merger):
+        raise NotImplementedError('order book mergers run in the worker processes')
+
+    def resubscribe(self, topic):
+        raise NotImplementedError('topics are subscribed in the worker processes')
+
+    def group(self, topic_set):
+        # 工作进程内部再按 wsapi_type 分连接
+        return {None: sorted(topic_set, key=str)}
+
+    def add_shard(self, topics):
+        self.partitions.append(topics)
+
+    async def run(self, collector=None):
+        ctx = multiprocessing.get_context('spawn')
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        deliver = None
+        if asyncio.iscoroutinefunction(collector):
+            self.backlog = collections.deque()
+            self.wakeup = asyncio.Event()
+            deliver = asyncio.ensure_future(self.deliver(collector, done))
+        self.readers = []
+        self.paused = False
+        workers = []
+        try:
+            for index, topics in enumerate(self.partitions):
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(
+                    target=_worker_main,
+                    args=(self.exchange.id, self.exchange.market_type, self.config,
+                          topics, self.depth, send_conn),
+                    daemon=True)
+                process.start()
+                send_conn.close()
+                callback = functools.partial(self.on_readable, index, recv_conn,
+                                             collector, done)
+                loop.add_reader(recv_conn.fileno(), callback)
+                self.readers.append((recv_conn, callback))
+                workers.append((process, recv_conn))
+            await done
+        finally:
+            if deliver:
+                deliver.cancel()
+                await asyncio.gather(deliver, return_exceptions=True)
+            self.pause_reading()
+            self.readers = []
+            self.backlog = None
+            for process, conn in workers:
+                conn.close()
+                process.terminate()
+            for process, _ in workers:
+                await loop.run_in_executor(None, process.join)
+
+    def on_readable(self, index, conn, collector, done):
+        if done.done():
+            return
+        try:
+            batch = conn.recv()
+        except EOFError:
+            done.set_exception(RuntimeError('worker process exited'))
+            return
+        if isinstance(batch, Exception):
+            done.set_exception(batch)
+            return
+        if isinstance(batch, _WorkerMetrics):
+            self.worker_metrics[index] = batch.metrics
+            return
+        if collector is None:
+            return
+        if self.backlog is not None:
+            self.backlog.append(batch)
+            if len(self.backlog) == 1:
+                self.wakeup.set()
+            if len(self.backlog) >= self.max_backlog:
+                self.pause_reading()
+            return
+        try:
+            for msg in batch:
+                try:
+                    collector(msg)
+                except StopIteration:
+                    pass
+        except Exception as exc:
+            done.set_exception(exc)
+
+    async def deliver(self, collector, done):
+        backlog = self.backlog
+        try:
+            while True:
+                if not backlog:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                for msg in backlog.popleft():
+                    await collector(msg)
+                if self.paused and len(backlog) <= self.max_backlog // 2:
+                    self.resume_reading()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if not done.done():
+                done.set_exception(exc)
+
+    def pause_reading(self):
+        loop = asyncio.get_running_loop()
+        for conn, _ in self.readers:
+            loop.remove_reader(conn.fileno())
+        self.paused = True
+
+    def resume_reading(self):
+        loop = asyncio.get_running_loop()
+        for conn, callback in self.readers:
+            loop.add_reader(conn.fileno(), callback)
+        self.paused = False
+
+
+class _Sender:
+    """在写线程中把消息成批发回主进程, 不阻塞工作进程的事件循环
+
+    主进程读得慢(管道写满)时, 写线程阻塞在 send 上, 这期间到达的消息
+    留在 pending 中: BookUpdate 按 market_id 只保留最新的一条(位置不变),
+    其他消息全部保留。metrics 等控制消息单独发送, 也只保留最新的。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = {}
+        self.control = {}
+        self.counter = itertools.count()
+        self.error = None
+        self.closed = False
+        self.ready = threading.Condition()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def __call__(self, msg):
+        if isinstance(msg, BookUpdate):
+            key = msg.market_id
+        else:
+            key = next(self.counter)
+        with self.ready:
+            if self.error:
+                raise self.error
+            if not self.pending:
+                self.ready.notify()
+            self.pending[key] = msg
+
+    def send_control(self, name, obj):
+        with self.ready:
+            self.control[name] = obj
+            self.ready.notify()
+
+    def write_loop(self):
+        conn = self.conn
+        while True:
+            with self.ready:
+                while not (self.pending or self.control or self.closed):
+                    self.ready.wait()
+                if not (self.pending or self.control):
+                    return
+                control = list(self.control.values())
+                batch = list(self.pending.values())
+                self.control.clear()
+                self.pending.clear()
+            try:
+                for obj in control:
+                    conn.send(obj)
+                if batch:
+                    conn.send(batch)
+            except Exception as exc:
+                with self.ready:
+                    self.error = exc
+                return
+
+    def close(self):
+        # 发送剩余的消息后结束写线程
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.thread.join()
+
+
+class _BookWorker(OrderBookManager):
+    def __init__(self, exchange, wshandler, depth, sender):
+        super().__init__(exchange, wshandler)
+        self.depth = depth
+        self.sender = sender
+        self.views = {}
+
+    def __call__(self, msg):
+        mergers = self.mergers
+        for market_id, patch in self.split(msg):
+            merger = mergers.get(market_id)
+            if merger is None:
+                merger = self.create_merger(market_id)
+            try:
+                merger(patch)
+            except StopIteration:
+                continue
+            view = self.views[market_id]
+            if view.changed:
+                self.sender(BookUpdate(market_id, view.asks, view.bids, merger.seqnum()))
+
+    def create_merger(self, market_id):
+        merger = super().create_merger(market_id)
+        self.views[market_id] = merger.view(self.depth)
+        return merger
+
+
+def _worker_main(exchange_id, market_type, config, topics, depth, conn):
+    sender = _Sender(conn)
+    try:
+        asyncio.run(_worker_run(exchange_id, market_type, config, topics, depth, sender))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        # 先发完已有的消息, 再报告错误
+        sender.close()
+        conn.send(RuntimeError(traceback.format_exc()))
+    finally:
+        sender.close()
+        conn.close()
+
+
+async def _worker_run(exchange_id, market_type, config, topics, depth, sender):
+    exchange = uxapi.new_exchange(exchange_id, market_type, config)
+    exchange.load_markets()
+    books = {topic for topic in topics if topic.datatype == 'orderbook.full'}
+    others = set(topics) - books
+    coros = []
+    handlers = []
+    if books:
+        wshandler = ShardedWSHandler(exchange, books)
+        handlers.append(wshandler)
+        coros.append(wshandler.run(_BookWorker(exchange, wshandler, depth, sender)))
+    if others:
+        wshandler = ShardedWSHandler(exchange, others)
+        handlers.append(wshandler)
+        coros.append(wshandler.run(sender))
+    coros.append(_report_metrics(handlers, sender))
+    await asyncio.gather(*coros)
+
+
+async def _report_metrics(handlers, sender, interval=1.0):
+    last = None
+    while True:
+        metrics = {
+            'reconnects': 0,
+            'total_downtime': 0.0,
+            'shards': [],
+        }
+        for handler in handlers:
+            handler_metrics = handler.metrics
+            metrics['reconnects'] += handler_metrics['reconnects']
+            metrics['total_downtime'] += handler_metrics['total_downtime']
+            metrics['shards'] += handler_metrics['shards']
+        if metrics != last:
+            sender.send_control('metrics', _WorkerMetrics(metrics))
+            last = metrics
+        await asyncio.sleep(interval)
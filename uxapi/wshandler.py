@@ -1,15 +1,40 @@
+import time
+import random
+import asyncio
 import logging
 
+import aiohttp
 from aiohttp import WSMsgType
 
 from uxapi import UXTopic
 from uxapi import Session
 from uxapi import Awaitables
-from uxapi import listiter
+from uxapi import ExecutionError
+from uxapi import MessageQueue
+from uxapi import Conflator
+from uxapi import ProcessorChain
+
+
+class ConnectionClosed(RuntimeError):
+    """websocket 连接被关闭或收到错误帧"""
 
 
 class WSHandler:
+    """websocket 连接的基类
+
+    连接断开(transport_errors 中的错误)后, 按带随机抖动的指数退避自动重连:
+    复用同一个 Session, 重新登录/订阅, 并通知已绑定的订单簿合并器重新同步。
+    collector、预处理器和合并器抛出的其他错误不重连, 照常从 run() 抛出。
+    reconnect 为 False 时保持原来的行为, 出错即退出 run()。
+    """
+
     logger = logging.getLogger(__name__)
+    transport_errors = (aiohttp.ClientError, asyncio.TimeoutError,
+                        ConnectionError, ConnectionClosed)
+    reconnect = True
+    max_reconnects = None       # None 表示不限次数
+    reconnect_delay = 1.0       # in seconds
+    max_reconnect_delay = 60.0  # in seconds
 
     def __init__(self, exchange, wsurl, topic_set):
         self.exchange = exchange
@@ -20,7 +45,15 @@ class WSHandler:
         self.ws = None
         self.pending_topics = None
         self.awaitables = Awaitables()
-        self.pre_processors = listiter([])
+        self.pre_processors = ProcessorChain()
+        self.mergers = []
+        self.recorder = None
+        self.metrics = {
+            'reconnects': 0,
+            'last_error': None,
+            'last_downtime': None,
+            'total_downtime': 0.0,
+        }
 
     def get_credentials(self):
         credentials = self.exchange.requiredCredentials
@@ -35,31 +68,152 @@ class WSHandler:
         return result
 
     async def run(self, collector=None):
+        attempts = 0
+        disconnected = None
+        connected = time.monotonic()
         try:
-            self.ws = await self.connect()
-            self.prepare()
-            await self.do_run(collector)
+            while True:
+                try:
+                    self.ws = await self.connect()
+                    if disconnected is not None:
+                        self.on_reconnected(time.monotonic() - disconnected)
+                        disconnected = None
+                    connected = time.monotonic()
+                    self.prepare()
+                    await self.do_run(collector)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    if not (self.reconnect and self.is_transport_error(exc)):
+                        raise
+                    if disconnected is None:
+                        # 连接稳定运行过一段时间, 重新开始退避
+                        if time.monotonic() - connected > self.max_reconnect_delay:
+                            attempts = 0
+                        disconnected = time.monotonic()
+                    if self.max_reconnects is not None and attempts >= self.max_reconnects:
+                        raise
+                    self.metrics['last_error'] = repr(exc)
+                    delay = self.backoff(attempts)
+                    attempts += 1
+                    self.logger.warning(f'{self.wsurl} disconnected ({exc!r}), '
+                                        f'reconnect in {delay:.1f}s', exc_info=True)
+                    await self.disconnect()
+                    self.on_disconnected()
+                    await asyncio.sleep(delay)
+                else:
+                    break
         finally:
             await self.cleanup()
 
+    def is_transport_error(self, exc):
+        # task 中的错误被包装为 ExecutionError
+        while isinstance(exc, ExecutionError) and exc.__cause__:
+            exc = exc.__cause__
+        return isinstance(exc, self.transport_errors)
+
+    def backoff(self, attempts):
+        delay = min(self.reconnect_delay * 2 ** attempts, self.max_reconnect_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def disconnect(self):
+        await self.awaitables.cleanup()
+        if self.ws:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+            self.ws = None
+        self.pre_processors.clear()
+        self.pending_topics = None
+
+    def on_disconnected(self):
+        for merger in self.mergers:
+            merger.on_disconnected()
+
+    def on_reconnected(self, downtime):
+        self.metrics['reconnects'] += 1
+        self.metrics['last_downtime'] = downtime
+        self.metrics['total_downtime'] += downtime
+        self.logger.info(f'{self.wsurl} reconnected after {downtime:.1f}s')
+
     async def do_run(self, collector):
+        # 消息在 reader 中收取和分发, 这里只监督 reader/keepalive/login 等
+        # task, 任何一个出错都会以 ExecutionError 抛出
+        self.awaitables.create_task(self.read_loop(collector), 'reader')
         while True:
-            if 'recv' not in self.awaitables:
-                self.awaitables.create_task(self.recv(), 'recv')
-            name, result = await self.awaitables.wait()
-            if name == 'recv' and result is not None:
+            await self.awaitables.wait()
+
+    async def read_loop(self, collector):
+        is_async = asyncio.iscoroutinefunction(collector)
+        recv = self.recv
+        while True:
+            data = await recv()
+            try:
+                msg = self.pre_process(data)
+            except StopIteration:
+                continue
+            if is_async:
+                await collector(msg)
+            elif collector is not None:
                 try:
-                    msg = self.pre_process(result)
+                    collector(msg)
                 except StopIteration:
+                    # 与预处理器一致, 同步的 collector(如 OrderBookManager)
+                    # 用 StopIteration 表示没有输出
+                    pass
+
+    async def stream(self, maxsize=1024, overflow='block'):
+        """以异步迭代器的方式接收消息::
+
+            async for msg in wshandler.stream():
+                ...
+
+        run() 在后台运行, 消息经过有界队列交给消费者, overflow 参见
+        MessageQueue; 队列保存在 stream_queue 中, 可以查看 dropped/coalesced
+        """
+        queue = MessageQueue(maxsize, overflow, self.message_key)
+        self.stream_queue = queue
+        collector = queue.put if overflow == 'block' else queue.put_nowait
+        task = asyncio.ensure_future(self.run(collector))
+        getter = None
+        try:
+            while True:
+                if queue:
+                    yield queue.get_nowait()
                     continue
-                else:
-                    if collector:
-                        collector(msg)
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    task.result()   # run() 结束时抛出它的异常
+                    return
+                msg, getter = getter.result(), None
+                yield msg
+        finally:
+            if getter:
+                getter.cancel()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
 
-    async def connect(self):
+    def conflate(self, consumer, maxsize=0):
+        """返回按频道合并消息的 collector::
+
+            await wshandler.run(wshandler.conflate(on_ticker))
+        """
+        return Conflator(consumer, self.message_key, maxsize)
+
+    def message_key(self, msg):
+        """消息所属的频道, 用于按频道合并消息; 不能合并的消息返回 None"""
+        return None
+
+    def get_session(self):
         if not self.session:
             self.session = Session()
             self.own_session = True
+        return self.session
+
+    async def connect(self):
+        self.get_session()
         ws = await self.session.ws_connect(self.wsurl)
         self.on_connected()
         return ws
@@ -72,11 +226,7 @@ class WSHandler:
             self.on_prepared()
 
     def pre_process(self, data):
-        msg = self.decode(data)
-        self.pre_processors.rewind()
-        for processor in self.pre_processors:
-            msg = processor(msg)
-        return msg
+        return self.pre_processors.dispatch(self.decode(data))
 
     def on_connected(self):
         pass
@@ -111,7 +261,7 @@ class WSHandler:
         raise NotImplementedError
 
     def on_logged_in(self):
-        self.pre_processors.remove()
+        self.pre_processors.remove(self.on_login_message)
         self.on_prepared()
 
     def on_prepared(self):
@@ -140,9 +290,29 @@ class WSHandler:
     def on_subscribed(self, topic):
         self.pending_topics.remove(topic)
         if not self.pending_topics:
-            self.pre_processors.remove()
+            self.pre_processors.remove(self.on_subscribe_message)
             self.pending_topics = None
 
+    def attach(self, merger):
+        merger.wshandler = self
+        self.mergers.append(merger)
+        return merger
+
+    def resubscribe(self, topic):
+        if self.pending_topics is None:
+            self.pending_topics = set()
+            self.pre_processors.append(self.on_subscribe_message)
+        self.pending_topics.add(topic)
+        return self.awaitables.create_task(self.send_resubscribe(topic))
+
+    async def send_resubscribe(self, topic):
+        for command in self.unsubscribe_commands({topic}):
+            await self.send(command)
+        await self.subscribe({topic})
+
+    def unsubscribe_commands(self, topic_set):
+        raise NotImplementedError
+
     async def send(self, command):
         if isinstance(command, dict):
             await self.ws.send_json(command)
@@ -152,21 +322,22 @@ class WSHandler:
     async def recv(self):
         wsmsg = await self.ws.receive()
         if wsmsg.type in (WSMsgType.BINARY, WSMsgType.TEXT):
+            if self.recorder:
+                self.recorder.write(wsmsg.data)
             return wsmsg.data
         else:
-            raise RuntimeError(f'unexpected message: {wsmsg}')
+            raise ConnectionClosed(f'unexpected message: {wsmsg}')
 
     def decode(self, data):
         return data
 
     async def cleanup(self):
-        await self.awaitables.cleanup()
+        await self.disconnect()
+        if self.recorder:
+            self.recorder.flush()
 
-        if self.ws:
-            try:
-                await self.ws.close()
-            except Exception:
-                pass
+        for merger in self.mergers:
+            await merger.close()
 
         if self.session and self.own_session:
             try: